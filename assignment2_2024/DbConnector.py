@@ -1,45 +1,166 @@
+from contextlib import contextmanager
+import configparser
+import os
+import threading
+import time
 import mysql.connector as mysql
+from mysql.connector import pooling
+from mysql.connector.errors import PoolError
+
+# Environment variables overriding the connection settings, e.g. to point tests at a local MySQL/MariaDB
+ENV_SETTINGS = {
+    'HOST': 'GEOLIFE_DB_HOST',
+    'PORT': 'GEOLIFE_DB_PORT',
+    'DATABASE': 'GEOLIFE_DB_DATABASE',
+    'USER': 'GEOLIFE_DB_USER',
+    'PASSWORD': 'GEOLIFE_DB_PASSWORD',
+}
+# Optional ini file with a [mysql] section using the lowercase names (host, port, database, user, password)
+CONFIG_FILE_ENV = 'GEOLIFE_DB_CONFIG'
+
+# mysql.connector refuses larger pools
+MAX_POOL_SIZE = pooling.CNX_POOL_MAXSIZE
+
+DEFAULT_SETTINGS = {
+    'HOST': "tdt4225-35.idi.ntnu.no",
+    'PORT': 3306,
+    'DATABASE': "testdb",
+    'USER': "camilbf",
+    'PASSWORD': "test123",
+}
+
+
+def load_settings(**overrides):
+    """
+    Connection settings from, in increasing priority: the defaults above, the ini file named by
+    GEOLIFE_DB_CONFIG, the GEOLIFE_DB_* environment variables and the arguments that are not None.
+    """
+    settings = dict(DEFAULT_SETTINGS)
+    config_file = os.environ.get(CONFIG_FILE_ENV)
+    if config_file:
+        parser = configparser.ConfigParser()
+        parser.read(config_file)
+        if parser.has_section('mysql'):
+            for name in settings:
+                if parser.has_option('mysql', name.lower()):
+                    settings[name] = parser.get('mysql', name.lower())
+    for name, variable in ENV_SETTINGS.items():
+        if variable in os.environ:
+            settings[name] = os.environ[variable]
+    settings.update({name: value for name, value in overrides.items() if value is not None})
+    settings['PORT'] = int(settings['PORT'])
+    return settings
+
 
 class DbConnector:
     """
     Connects to the MySQL server on the Ubuntu virtual machine.
     Connector needs HOST, DATABASE, USER and PASSWORD to connect,
-    while PORT is optional and should be 3306.
+    while PORT is optional and should be 3306. Values not passed
+    are read from GEOLIFE_DB_* environment variables or the
+    GEOLIFE_DB_CONFIG ini file, see load_settings.
 
     Example:
     HOST = "tdt4225-00.idi.ntnu.no" // Your server IP address/domain name
     DATABASE = "testdb" // Database name, if you just want to connect to MySQL server, leave it empty
     USER = "testuser" // This is the user you created and added privileges for
     PASSWORD = "test123" // The password you set for said user
+
+    With POOL_SIZE, connections come from a mysql.connector pool shared by every DbConnector with
+    the same settings, and close_connection hands the connection back instead of closing it.
+    borrowed_connection() and borrowed_cursor() borrow a further pooled connection for a with-block.
     """
 
+    _pools = {}
+    _pools_lock = threading.Lock()
+
     def __init__(self,
-                 HOST="tdt4225-35.idi.ntnu.no",
-                 DATABASE="testdb",
-                 USER="camilbf",
-                 PASSWORD="test123"):
+                 HOST=None,
+                 DATABASE=None,
+                 USER=None,
+                 PASSWORD=None,
+                 PORT=None,
+                 ALLOW_LOCAL_INFILE=False,
+                 POOL_SIZE=None,
+                 VERBOSE=True):
+        settings = load_settings(HOST=HOST, DATABASE=DATABASE, USER=USER, PASSWORD=PASSWORD, PORT=PORT)
+        self.config = dict(host=settings['HOST'], database=settings['DATABASE'], user=settings['USER'],
+                           password=settings['PASSWORD'], port=settings['PORT'], allow_local_infile=ALLOW_LOCAL_INFILE)
+        self.verbose = VERBOSE
+        self.pool = None
+        if POOL_SIZE and not 1 <= POOL_SIZE <= MAX_POOL_SIZE:
+            raise ValueError(f"POOL_SIZE must be between 1 and {MAX_POOL_SIZE}, got {POOL_SIZE}")
+
         # Connect to the database
         try:
-            self.db_connection = mysql.connect(host=HOST, database=DATABASE, user=USER, password=PASSWORD, port=3306)
-            
+            self.pool = self.get_pool(POOL_SIZE) if POOL_SIZE else None
+            self.db_connection = self.borrow_connection() if self.pool else mysql.connect(**self.config)
 
         except Exception as e:
             print("ERROR: Failed to connect to db:", e)
+            raise
 
         # Get the db cursor
         self.cursor = self.db_connection.cursor()
 
-        print("Connected to:", self.db_connection.get_server_info())
-        # get database information
-        self.cursor.execute("select database();")
-        database_name = self.cursor.fetchone()
-        print("You are connected to the database:", database_name)
-        print("-----------------------------------------------\n")
+        if self.verbose:
+            print("Connected to:", self.db_connection.get_server_info())
+            # get database information
+            self.cursor.execute("select database();")
+            database_name = self.cursor.fetchone()
+            print("You are connected to the database:", database_name)
+            print("-----------------------------------------------\n")
+
+    def get_pool(self, pool_size):
+        key = tuple(sorted(self.config.items())) + (pool_size,)
+        with DbConnector._pools_lock:
+            if key not in DbConnector._pools:
+                DbConnector._pools[key] = pooling.MySQLConnectionPool(
+                    pool_name=f"geolife{len(DbConnector._pools)}", pool_size=pool_size, **self.config)
+            return DbConnector._pools[key]
+
+    def borrow_connection(self, timeout=30):
+        # The pool raises instead of waiting when it is exhausted, so retry until timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                connection = self.pool.get_connection()
+                break
+            except PoolError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+        # Health check: a connection that sat idle in the pool may have been dropped by the server
+        connection.ping(reconnect=True, attempts=3, delay=1)
+        return connection
+
+    @contextmanager
+    def borrowed_connection(self):
+        """Borrows a connection for the with-block (pooled mode), or yields this connector's own connection."""
+        if not self.pool:
+            yield self.db_connection
+            return
+        connection = self.borrow_connection()
+        try:
+            yield connection
+        finally:
+            connection.close()  # Returns it to the pool
+
+    @contextmanager
+    def borrowed_cursor(self, **cursor_args):
+        with self.borrowed_connection() as connection:
+            cursor = connection.cursor(**cursor_args)
+            try:
+                yield cursor
+            finally:
+                cursor.close()
 
     def close_connection(self):
         # close the cursor
         self.cursor.close()
-        # close the DB connection
+        server_info = self.db_connection.get_server_info()
+        # close the DB connection (back to the pool in pooled mode)
         self.db_connection.close()
-        print("\n-----------------------------------------------")
-        print("Connection to %s is closed" % self.db_connection.get_server_info())
+        if self.verbose:
+            print("\n-----------------------------------------------")
+            print("Connection to %s is closed" % server_info)
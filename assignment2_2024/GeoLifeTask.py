@@ -1,14 +1,51 @@
-from DbConnector import DbConnector
+from DbConnector import MAX_POOL_SIZE, DbConnector
+from activity_summary import SUMMARY_COLUMNS, activity_summary_table, summarize_chunks, summarize_track
+from bulk_loader import BulkLoader
+from grid import GRID_CELL_SQL, grid_cells
+from instrumentation import NO_INSTRUMENTS, Instruments
+from label_index import LabelIndex
+from manifest import IngestManifest, manifest_table
+from plt_parser import count_points, read_plt, time_bounds
+from query_cache import data_version_table
+from simplify import SIMPLIFIED_COLUMNS, TrackSimplifier, simplified_trackpoint_table
+from streaming import stream_arrays
+import numpy as np
 from tabulate import tabulate
+from collections import deque
 from datetime import datetime
+from multiprocessing import Pool
+import argparse
 import os
+import queue
+import threading
+import time
+import uuid
 
 class GeolifeDataProcessor:
 
-    def __init__(self):
-        self.db_connector = DbConnector()
+    def __init__(self, loader='row', label_matching='exact', instruments=None, simplifier=None, store_raw=True,
+                 **db_config):
+        # loader is 'row' (insert_activity + batch_insert_trackpoints) or 'bulk' (BulkLoader)
+        self.loader = loader
+        # label_matching is 'exact' (label must span the whole file) or 'segment' (one activity per label)
+        self.label_matching = label_matching
+        # Per-stage timers and counters, see instrumentation.py; disabled unless passed in
+        self.instruments = instruments or NO_INSTRUMENTS
+        # With a TrackSimplifier, activities are also written to TrackPointSimplified; store_raw=False
+        # writes only that tier and leaves TrackPoint empty
+        self.simplifier = simplifier
+        self.store_raw = store_raw
+        self.db_config = db_config
+        if loader == 'bulk':
+            db_config = dict(db_config, ALLOW_LOCAL_INFILE=True)
+        self.db_connector = DbConnector(**db_config)
         self.connection = self.db_connector.db_connection
         self.cursor = self.db_connector.cursor
+        self.manifest = IngestManifest(self.cursor)
+        self.bulk_loader = None
+        if loader == 'bulk':
+            self.bulk_loader = BulkLoader(self.connection, self.cursor)
+            self.bulk_loader.before_commit = self.manifest.apply
 
     def create_table(self, table_name, table_definition):
         self.cursor.execute(table_definition % table_name)
@@ -42,7 +79,7 @@ class GeolifeDataProcessor:
         structure = self.cursor.fetchall()
         print(tabulate(structure))
 
-    def insert_user_table(self):
+    def insert_user_table(self, labeled_ids_file=r"dataset/labeled_ids.txt"):
         insert_user_query = "INSERT INTO User (id, has_label) VALUES (%s, %s)"
         check_user_query = "SELECT COUNT(*) FROM User WHERE id = %s"
         update_user_label_query = "UPDATE User SET has_label = true WHERE id = %s"
@@ -54,101 +91,439 @@ class GeolifeDataProcessor:
                 self.cursor.execute(insert_user_query, (formatted_user_id, False))
                 self.connection.commit()
 
-        with open(r"dataset/labeled_ids.txt", 'r') as file:
+        with open(labeled_ids_file, 'r') as file:
             labeled_users = [line.strip() for line in file]
             self.cursor.executemany(update_user_label_query, [(user_id,) for user_id in labeled_users])
             self.connection.commit()
 
-    def insert_activity(self, user_id, transportation_mode, start_time, end_time):
+    def insert_activity(self, user_id, transportation_mode, start_time, end_time, activity_id=None, commit=True):
         query = """
-        INSERT INTO Activity (user_id, transportation_mode, start_date_time, end_date_time)
-        VALUES (%s, %s, %s, %s)
+        INSERT INTO Activity (id, user_id, transportation_mode, start_date_time, end_date_time)
+        VALUES (%s, %s, %s, %s, %s)
         """
-        self.cursor.execute(query, (user_id, transportation_mode, start_time, end_time))
-        self.connection.commit()
+        # A NULL id lets AUTO_INCREMENT pick it; the parallel loader passes pre-assigned ids
+        with self.instruments.timer('insert_activity'):
+            self.cursor.execute(query, (activity_id, user_id, transportation_mode, start_time, end_time))
+        if commit:
+            self.commit()
         return self.cursor.lastrowid
     
-    def batch_insert_trackpoints(self, trackpoints, batch_size=1000):
+    def batch_insert_trackpoints(self, trackpoints, batch_size=1000, commit=True):
         query = """
-        INSERT INTO TrackPoint (activity_id, latitude, longitude, altitude, date_time)
-        VALUES (%s, %s, %s, %s, %s)
+        INSERT INTO TrackPoint (activity_id, latitude, longitude, altitude, date_time, grid_cell)
+        VALUES (%s, %s, %s, %s, %s, %s)
         """
         for i in range(0, len(trackpoints), batch_size):
             batch = trackpoints[i:i+batch_size]
-            self.cursor.executemany(query, batch)
+            with self.instruments.timer('executemany_trackpoints'):
+                self.cursor.executemany(query, batch)
+        if commit:
+            self.commit()
+
+    def insert_simplified_trackpoints(self, trackpoints, batch_size=1000, commit=True):
+        query = f"""
+        INSERT INTO TrackPointSimplified ({', '.join(SIMPLIFIED_COLUMNS)})
+        VALUES ({', '.join(['%s'] * len(SIMPLIFIED_COLUMNS))})
+        """
+        for i in range(0, len(trackpoints), batch_size):
+            with self.instruments.timer('executemany_simplified'):
+                self.cursor.executemany(query, trackpoints[i:i + batch_size])
+        if commit:
+            self.commit()
+
+    def insert_activity_summaries(self, summaries, commit=True):
+        # summaries are (activity_id, ...) tuples in SUMMARY_COLUMNS order
+        query = f"""
+        REPLACE INTO ActivitySummary ({', '.join(SUMMARY_COLUMNS)})
+        VALUES ({', '.join(['%s'] * len(SUMMARY_COLUMNS))})
+        """
+        with self.instruments.timer('insert_activity_summaries'):
+            self.cursor.executemany(query, summaries)
+        if commit:
+            self.commit()
+
+    def commit(self):
+        with self.instruments.timer('commit'):
+            self.connection.commit()
+
+    def write_activity(self, activity_id, user_id, transportation_mode, start_time, end_time, track, commit=True):
+        points = []
+        if self.store_raw:
+            with self.instruments.timer('build_rows'):
+                points = track.rows(grid_cells(track.latitude, track.longitude))
+        simplified_points = None
+        if self.simplifier:
+            with self.instruments.timer('simplify'):
+                simplified, distances, gains = self.simplifier.simplify(track)
+                simplified_points = simplified.rows(grid_cells(simplified.latitude, simplified.longitude), distances, gains)
+            self.instruments.count('simplified_trackpoints', simplified.size)
+        # The aggregates are computed here while the track is in memory, not later from TrackPoint
+        with self.instruments.timer('summarize_track'):
+            summary = summarize_track(track)
+        self.instruments.count('activities')
+        self.instruments.count('trackpoints', track.size)
+        self.instruments.observe('points_per_activity', track.size)
+        if self.bulk_loader:
+            self.bulk_loader.add(activity_id, user_id, transportation_mode, start_time, end_time, points, summary,
+                                 simplified_points)
+            return activity_id
+        # One commit per activity, so a crash never leaves an activity without its trackpoints
+        activity_id = self.insert_activity(user_id, transportation_mode, start_time, end_time, activity_id, commit=False)
+        self.batch_insert_trackpoints([(activity_id,) + point for point in points], commit=False)
+        if simplified_points is not None:
+            self.insert_simplified_trackpoints([(activity_id,) + point for point in simplified_points], commit=False)
+        self.insert_activity_summaries([(activity_id,) + summary], commit=commit)
+        return activity_id
+
+    def rebuild_activity_summaries(self, chunk_size=50000):
+        """
+        Recomputes ActivitySummary from the TrackPoint table, for data loaded before the summary
+        table existed. TrackPoint is streamed in activity order, so memory use stays bounded.
+        """
+        query = """
+        SELECT activity_id, latitude, longitude, altitude, date_time
+        FROM TrackPoint
+        ORDER BY activity_id, date_time
+        """
+        chunks = stream_arrays(self.connection, query, (), (np.int64, float, float, np.int64, 'datetime64[s]'), chunk_size)
+        # Collected first, the connection cannot insert while the streamed result is open
+        summaries = list(summarize_chunks(chunks))
+        for i in range(0, len(summaries), 1000):
+            self.insert_activity_summaries(summaries[i:i + 1000], commit=False)
         self.connection.commit()
+        self.bump_data_version()
+        print(f"Rebuilt {len(summaries)} activity summaries")
+
+    def write_plt_activities(self, plt_file_path, user_id, activities, activity_id=None, file_info=None):
+        """
+        Writes the parsed activities of one .plt file and returns their ids. With file_info from
+        IngestManifest.check, the file's old activities are replaced and its manifest entry is
+        written in the same transaction as the new rows.
+
+        An error while writing the file only drops that file's rows and is reported here. A failed
+        bulk flush is raised instead: it rolls back the staged rows of every earlier file too, so
+        the load cannot go on.
+        """
+        activity_ids = []
+        checkpoint = self.bulk_loader.checkpoint() if self.bulk_loader else None
+        try:
+            for label, start_date_time, end_date_time, track in activities:
+                activity_ids.append(self.write_activity(activity_id, user_id, label, start_date_time, end_date_time,
+                                                        track, commit=file_info is None))
+                if activity_id is not None:
+                    activity_id += 1
+
+            if file_info is not None:
+                # With the bulk loader the entry is committed with the rows, by the flush
+                self.manifest.record(file_info, activity_ids)
+                if not self.bulk_loader:
+                    self.manifest.apply()
+                    self.commit()
+
+        except Exception as e:
+            print(f"Error processing .plt file {plt_file_path}: {e}")
+            self.instruments.count('files_failed')
+            if self.bulk_loader:
+                self.bulk_loader.discard_since(checkpoint)
+            else:
+                self.connection.rollback()
+                if file_info is not None:
+                    self.manifest.discard()
+            return []
+
+        if self.bulk_loader and self.bulk_loader.is_full():
+            self.flush_bulk_loader()
+        return activity_ids
+
+    def flush_bulk_loader(self):
+        # A failed flush has rolled back every staged file, so their manifest entries go too
+        try:
+            with self.instruments.timer('bulk_flush'):
+                self.bulk_loader.flush()
+        except Exception:
+            self.manifest.discard()
+            raise
+
+    def finish_loading(self):
+        # Loads whatever the bulk loader still has staged
+        if self.bulk_loader:
+            self.flush_bulk_loader()
 
     def parse_labels(self, labels_file_path):
-        labels = []
-        with open(labels_file_path, 'r') as file:
-            next(file)
-            for line in file:
-                start_time, end_time, mode = line.strip().split('\t')
-                start_time = datetime.strptime(start_time, '%Y/%m/%d %H:%M:%S')  
-                end_time = datetime.strptime(end_time, '%Y/%m/%d %H:%M:%S')  
-                labels.append((start_time, end_time, mode))
-        return labels
+        return parse_labels(labels_file_path)
     
-    def process_plt_file(self, plt_file_path, user_id, labels):
+    def process_plt_file(self, plt_file_path, user_id, labels, activity_id=None, file_info=None):
+        # Returns the ids of the inserted activities; with pre-assigned ids they follow activity_id
+        activities = parse_plt_file(plt_file_path, labels, self.label_matching, self.instruments)
+        return self.write_plt_activities(plt_file_path, user_id, activities, activity_id, file_info)
+
+    def next_activity_id(self):
+        self.cursor.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM Activity")
+        return self.cursor.fetchone()[0]
+
+    def bump_data_version(self):
+        # Invalidates every cached query result (see query_cache.QueryCache). The random token keeps
+        # the stamp unique when DataVersion is dropped and its version starts over at 1
+        token = uuid.uuid4().hex
+        self.cursor.execute("""
+        INSERT INTO DataVersion (id, version, token, updated_at) VALUES (1, 1, %s, NOW())
+        ON DUPLICATE KEY UPDATE version = version + 1, token = %s, updated_at = NOW()
+        """, (token, token))
+        self.connection.commit()
+
+    def ensure_data_version_token(self):
+        # Adds DataVersion.token in databases created before the column existed
+        if not self.column_exists('DataVersion', 'token'):
+            self.cursor.execute("ALTER TABLE DataVersion ADD COLUMN token CHAR(32) AFTER version")
+            self.connection.commit()
+
+    def changed_plt_files(self, data_directory, incremental):
+        # Yields (user_id, plt_file_path, labels_file, file_info), skipping files the manifest has as
+        # loaded; without incremental every file counts as changed, so its old activities are replaced
+        self.manifest.load(data_directory, self.label_matching)
+        for user_id, plt_file_path, labels_file in iter_plt_files(data_directory):
+            with self.instruments.timer('manifest_check'):
+                file_info = self.manifest.check(plt_file_path, labels_file, force=not incremental)
+            if file_info is None:
+                self.instruments.count('files_unchanged')
+                continue
+            yield user_id, plt_file_path, labels_file, file_info
+
+    def process_geolife_data(self, data_directory, incremental=True):
+        """
+        Loads every .plt file under data_directory. With incremental=True, files recorded in the
+        IngestManifest table and unchanged since are skipped, changed files replace their old
+        activities, and a run that was interrupted continues where it stopped. incremental=False
+        reloads every file, replacing the activities the manifest has for it.
+        """
+        # Activity ids are assigned up front like in the parallel loader, so both produce the same activities
+        activity_id = self.next_activity_id()
+        labels_by_user = {}
+        files = 0
         try:
-            with open(plt_file_path, 'r') as file:
-                lines = file.readlines()[6:]  # Skip the header (first 6 lines)
+            for user_id, plt_file_path, labels_file, file_info in self.changed_plt_files(data_directory, incremental):
+                files += 1
+                if user_id not in labels_by_user:
+                    with self.instruments.timer('parse_labels'):
+                        labels_by_user[user_id] = self.parse_labels(labels_file) if os.path.exists(labels_file) else LabelIndex()
+                activities = parse_plt_file(plt_file_path, labels_by_user[user_id], self.label_matching, self.instruments)
+                self.write_plt_activities(plt_file_path, user_id, activities, activity_id, file_info)
+                # Ids of a file that failed are not reused: some of its activities may be committed already
+                activity_id += len(activities)
+            self.finish_loading()
+        finally:
+            # Also after an error, earlier files may be committed; a run that wrote nothing keeps the cache
+            if files:
+                self.bump_data_version()
+        # Stat refreshes of touched but unchanged files
+        self.manifest.apply()
+        self.connection.commit()
 
-                # Check if the activity exceeds 2500 trackpoints
-                if len(lines) > 2500:
-                    return  # Skip this activity and do not insert anything
+    def process_geolife_data_parallel(self, data_directory, workers=4, writers=2, queue_size=64, in_flight=None,
+                                      incremental=True):
+        """
+        Parses .plt files in a pool of `workers` processes and hands the parsed activities
+        to `writers` threads, each inserting on its own DB connection.
 
-                # Process start and end time
-                start_line = lines[0].strip().split(',')
-                end_line = lines[-1].strip().split(',')
+        Files are visited in sorted order and parse results are consumed in that same order,
+        so activity ids are assigned here (not by AUTO_INCREMENT): the Activity rows and the
+        contents of every row are the same whatever the number of workers and writers. The ids
+        of TrackPoint and TrackPointSimplified rows still follow the order the writers commit in.
+        incremental works as in process_geolife_data, the manifest is checked here and written
+        by the writers.
 
+        At most `in_flight` files (default 2 per worker) are submitted to the pool ahead of the
+        one being handed off, and at most `queue_size` parsed files wait for a writer, so memory
+        stays bounded when the writers are slower than the parsers. If a writer fails, loading
+        stops and its error is raised.
+        """
+        in_flight = in_flight or 2 * workers
+        write_queue = queue.Queue(maxsize=queue_size)
+        stats = {'files': 0, 'activities': 0, 'trackpoints': 0}
+        stats_lock = threading.Lock()
+        writer_errors = []
+
+        def writer():
+            processor = None
+            try:
+                processor = GeolifeDataProcessor(self.loader, self.label_matching, self.instruments, self.simplifier,
+                                                 self.store_raw, **dict(self.db_config, VERBOSE=False))
+                while True:
+                    # Time spent waiting here means the parsers are the bottleneck
+                    with self.instruments.timer('writer_wait'):
+                        item = write_queue.get()
+                    if item is None:
+                        break
+                    activity_id, user_id, plt_file_path, activities, file_info = item
+                    activity_ids = processor.write_plt_activities(plt_file_path, user_id, activities, activity_id, file_info)
+                    with stats_lock:
+                        stats['activities'] += len(activity_ids)
+                        stats['trackpoints'] += sum(activity[3].size for activity in activities) if activity_ids else 0
+                processor.finish_loading()
+            except Exception as e:
+                writer_errors.append(e)
+            finally:
+                if processor:
+                    processor.db_connector.close_connection()
+
+        # The pool forks its workers here, before the writer threads and their connections exist
+        pool = Pool(processes=workers)
+        threads = [threading.Thread(target=writer) for _ in range(writers)]
+        try:
+            for thread in threads:
+                thread.start()
+        except Exception:
+            pool.terminate()
+            raise
+
+        def hand_off(item):
+            # put() with a timeout, so a producer never waits on a queue no writer is draining anymore
+            while any(thread.is_alive() for thread in threads):
                 try:
-                    start_date_time = datetime.strptime(f"{start_line[5].strip()} {start_line[6].strip()}", '%Y-%m-%d %H:%M:%S')
-                    end_date_time = datetime.strptime(f"{end_line[5].strip()} {end_line[6].strip()}", '%Y-%m-%d %H:%M:%S')
-                except ValueError as e:
-                    print(f"Error parsing date and time for file {plt_file_path}: {e}")
-                    return  # Skip this file if parsing fails
+                    write_queue.put(item, timeout=1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
 
-                # Match label based on start and end time
-                label = next((lbl[2] for lbl in labels if lbl[0] == start_date_time and lbl[1] == end_date_time), None)
-                if not label:
-                    return  # Skip if no matching label is found
-
-                # Insert the activity
-                activity_id = self.insert_activity(user_id, label, start_date_time, end_date_time)
-
-                # Prepare trackpoints for insertion
-                trackpoints = []
-                for line in lines:
-                    lat, lon, _, altitude, _, date, time = line.strip().split(',')
-                    try:
-                        date_time = datetime.strptime(f"{date.strip()} {time.strip()}", '%Y-%m-%d %H:%M:%S')
-                    except ValueError as e:
-                        print(f"Skipping trackpoint with invalid date/time format: {e}")
-                        continue  # Skip trackpoint if the date-time format is invalid
-                    
-                    trackpoints.append((activity_id, float(lat), float(lon), int(float(altitude)), date_time))
-
-                # Insert trackpoints in batches
-                self.batch_insert_trackpoints(trackpoints)
+        pending = deque()
+        activity_id = self.next_activity_id()
 
-        except Exception as e:
-            print(f"Error processing .plt file {plt_file_path}: {e}")
+        def hand_off_oldest():
+            # Results are taken in submission order, which is what makes id assignment deterministic
+            nonlocal activity_id
+            (plt_file_path, file_info), result = pending.popleft()
+            user_id, activities, worker_metrics = result.get()
+            stats['files'] += 1
+            self.instruments.merge(worker_metrics)
+            # Files without activities still go to a writer so the manifest records them
+            # Time spent blocked here means the writers are the bottleneck
+            with self.instruments.timer('queue_put'):
+                if writer_errors or not hand_off((activity_id, user_id, plt_file_path, activities, file_info)):
+                    return False
+            activity_id += len(activities)
+            return True
+
+        start = time.perf_counter()
+        try:
+            with pool:
+                for user_id, plt_file_path, labels_file, file_info in self.changed_plt_files(data_directory, incremental):
+                    if len(pending) >= in_flight and not hand_off_oldest():
+                        break
+                    job = (user_id, plt_file_path, labels_file, self.label_matching, self.instruments.enabled)
+                    pending.append(((plt_file_path, file_info), pool.apply_async(_parse_job, (job,))))
+                else:
+                    while pending and hand_off_oldest():
+                        pass
+        finally:
+            for _ in threads:
+                hand_off(None)
+            for thread in threads:
+                thread.join()
+            # Also after an error, earlier files may be committed; a run that wrote nothing keeps the cache
+            if stats['files']:
+                self.bump_data_version()
+        if writer_errors:
+            raise writer_errors[0]
+        self.manifest.apply()
+        self.connection.commit()
 
-    def process_geolife_data(self, data_directory):
-        for user_folder in os.listdir(data_directory):
-            user_id = user_folder
-            trajectory_folder = os.path.join(data_directory, user_id, 'Trajectory')
-            labels_file = os.path.join(data_directory, user_id, 'labels.txt')
+        elapsed = time.perf_counter() - start
+        stats['seconds'] = elapsed
+        print(f"Loaded {stats['activities']} activities and {stats['trackpoints']} trackpoints "
+              f"from {stats['files']} files in {elapsed:.1f}s "
+              f"({stats['files'] / elapsed:.1f} files/sec, {stats['trackpoints'] / elapsed:.0f} trackpoints/sec)")
+        return stats
 
-            labels = self.parse_labels(labels_file) if os.path.exists(labels_file) else []
+    def index_exists(self, table_name, index_name):
+        self.cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND INDEX_NAME = %s
+        """, (table_name, index_name))
+        return self.cursor.fetchone()[0] > 0
+
+    def create_indexes(self):
+        """
+        Builds the secondary indexes in schema_indexes. Run it after the bulk load: one index build
+        at the end is much cheaper than maintaining the indexes on every inserted row. Spatial
+        lookups go through the grid_cell index, so indexes of earlier versions that no query uses
+        anymore are dropped.
+        """
+        self.ensure_grid_cells()
+        self.drop_obsolete_indexes()
+        for table_name, index_name, columns in schema_indexes:
+            if not self.index_exists(table_name, index_name):
+                print(f"Creating index {index_name} on {table_name} {columns}...")
+                self.cursor.execute(f"CREATE INDEX {index_name} ON {table_name} {columns}")
+        self.connection.commit()
+
+    def drop_obsolete_indexes(self):
+        # The (latitude, longitude) index and the SPATIAL location column, both replaced by grid_cell
+        if self.index_exists('TrackPoint', 'idx_trackpoint_lat_lon'):
+            print("Dropping idx_trackpoint_lat_lon from TrackPoint...")
+            self.cursor.execute("DROP INDEX idx_trackpoint_lat_lon ON TrackPoint")
+        if self.index_exists('TrackPoint', 'idx_trackpoint_location'):
+            print("Dropping the location column and its SPATIAL index from TrackPoint...")
+            self.cursor.execute("ALTER TABLE TrackPoint DROP INDEX idx_trackpoint_location, DROP COLUMN location")
+
+    def column_exists(self, table_name, column_name):
+        self.cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = %s
+        """, (table_name, column_name))
+        return self.cursor.fetchone()[0] > 0
+
+    def ensure_grid_cells(self):
+        # Adds and fills TrackPoint.grid_cell in databases created before the column existed
+        if not self.column_exists('TrackPoint', 'grid_cell'):
+            print("Adding grid_cell to TrackPoint...")
+            self.cursor.execute("ALTER TABLE TrackPoint ADD COLUMN grid_cell INT")
+            self.cursor.execute(f"UPDATE TrackPoint SET grid_cell = {GRID_CELL_SQL}")
+            self.connection.commit()
+
+    def drop_indexes(self):
+        # Removes what create_indexes added, used by the before/after index benchmark
+        for table_name, index_name, _ in schema_indexes:
+            if self.index_exists(table_name, index_name):
+                self.cursor.execute(f"DROP INDEX {index_name} ON {table_name}")
+        self.drop_obsolete_indexes()
+        self.connection.commit()
+
+    def is_partitioned(self, table_name):
+        self.cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.PARTITIONS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND PARTITION_NAME IS NOT NULL
+        """, (table_name,))
+        return self.cursor.fetchone()[0] > 0
+
+    def partition_trackpoints_by_year(self, first_year=2007, last_year=2012):
+        """
+        Partitions TrackPoint by YEAR(date_time), one partition per year plus one for the rest.
+        MySQL does not allow foreign keys on partitioned tables, so the foreign key to Activity is
+        dropped (deletes then go through IngestManifest, not ON DELETE CASCADE) and the primary key
+        becomes (id, date_time), as the partition column must be part of it.
+        """
+        if self.is_partitioned('TrackPoint'):
+            return
+        self.cursor.execute("""
+        SELECT CONSTRAINT_NAME FROM information_schema.REFERENTIAL_CONSTRAINTS
+        WHERE CONSTRAINT_SCHEMA = DATABASE() AND TABLE_NAME = 'TrackPoint'
+        """)
+        for (constraint_name,) in self.cursor.fetchall():
+            self.cursor.execute(f"ALTER TABLE TrackPoint DROP FOREIGN KEY {constraint_name}")
+        self.drop_obsolete_indexes()
+
+        partitions = [f"PARTITION p{year} VALUES LESS THAN ({year + 1})" for year in range(first_year, last_year + 1)]
+        partitions.append("PARTITION pmax VALUES LESS THAN MAXVALUE")
+        print(f"Partitioning TrackPoint by year {first_year}-{last_year}...")
+        self.cursor.execute(f"""
+        ALTER TABLE TrackPoint
+        MODIFY date_time DATETIME NOT NULL,
+        DROP PRIMARY KEY, ADD PRIMARY KEY (id, date_time)
+        PARTITION BY RANGE (YEAR(date_time)) ({', '.join(partitions)})
+        """)
+        self.connection.commit()
 
-            if os.path.isdir(trajectory_folder):
-                for plt_file in os.listdir(trajectory_folder):
-                    if plt_file.endswith('.plt'):
-                        plt_file_path = os.path.join(trajectory_folder, plt_file)
-                        self.process_plt_file(plt_file_path, user_id, labels)
-    
     def display_top10_rows(self):
         tables = ['User', 'Activity', 'TrackPoint']
         for table in tables:
@@ -159,6 +534,117 @@ class GeolifeDataProcessor:
             print(tabulate(rows, headers=self.cursor.column_names))
             print()
 
+def sorted_entries(directory):
+    with os.scandir(directory) as entries:
+        return sorted(entries, key=lambda entry: entry.name)
+
+
+def iter_plt_files(data_directory):
+    """
+    Yields (user_id, plt_file_path, labels_file) in sorted order so every loader sees the same
+    sequence. A user's Trajectory folder is only listed when the previous user is done, so the
+    first file is yielded right away and no file list of the whole dataset is ever built.
+    """
+    for user_entry in sorted_entries(data_directory):
+        trajectory_folder = os.path.join(user_entry.path, 'Trajectory')
+        if not user_entry.is_dir() or not os.path.isdir(trajectory_folder):
+            continue
+        labels_file = os.path.join(user_entry.path, 'labels.txt')
+        for entry in sorted_entries(trajectory_folder):
+            if entry.name.endswith('.plt') and entry.is_file():
+                yield user_entry.name, entry.path, labels_file
+
+
+def parse_labels(labels_file_path):
+    # Returns a LabelIndex over the (start_time, end_time, mode) labels of the file
+    labels = []
+    with open(labels_file_path, 'r') as file:
+        next(file)
+        for line in file:
+            start_time, end_time, mode = line.strip().split('\t')
+            start_time = datetime.strptime(start_time, '%Y/%m/%d %H:%M:%S')
+            end_time = datetime.strptime(end_time, '%Y/%m/%d %H:%M:%S')
+            labels.append((start_time, end_time, mode))
+    return LabelIndex(labels)
+
+
+def parse_plt_file(plt_file_path, labels, label_matching='exact', instruments=NO_INSTRUMENTS):
+    """
+    Parses a .plt file into a list of (label, start_date_time, end_date_time, track) activities,
+    where track is a PltTrack of column arrays. The list is empty if the file is skipped.
+
+    With label_matching='exact' the file is one activity if a label has exactly its start and end
+    time. With 'segment' every label overlapping the file becomes an activity made of the
+    trackpoints it covers. Kept at module level so it can run in worker processes.
+
+    A file is only parsed once it is known to qualify: files of unlabeled users are not opened,
+    and the labels are matched on the first and last line, exactly in 'exact' mode and by overlap
+    in 'segment' mode. In 'exact' mode the point cap is also checked first, with a line count
+    that stops right after MAX_TRACKPOINTS lines.
+    """
+    try:
+        if not len(labels):
+            instruments.count('files_unlabeled')
+            return []
+        with instruments.timer('time_bounds'):
+            bounds = time_bounds(plt_file_path)
+        if bounds is None:
+            return []
+        if label_matching == 'segment' and not labels.overlapping(*bounds):
+            instruments.count('files_unlabeled')
+            return []
+        if label_matching == 'exact':
+            if not labels.match(*bounds):
+                instruments.count('files_unlabeled')
+                return []
+            with instruments.timer('count_points'):
+                over_limit = count_points(plt_file_path, MAX_TRACKPOINTS) > MAX_TRACKPOINTS
+            if over_limit:
+                instruments.count('activities_over_limit')
+                return []
+
+        with instruments.timer('read_plt'):
+            track = read_plt(plt_file_path)
+        instruments.count('files_parsed')
+        if track.size == 0:
+            return []
+
+        with instruments.timer('label_match'):
+            if label_matching == 'segment':
+                tracks = [(label, track.slice(first, stop)) for label, first, stop in labels.segments(track.date_time)]
+            else:
+                # Match label based on start and end time
+                label = labels.match(track.start_time(), track.end_time())
+                tracks = [(label, track)] if label else []  # Skip if no matching label is found
+
+        # Skip activities exceeding 2500 trackpoints and do not insert anything
+        activities = [(label, activity_track.start_time(), activity_track.end_time(), activity_track)
+                      for label, activity_track in tracks if activity_track.size <= MAX_TRACKPOINTS]
+        instruments.count('activities_over_limit', len(tracks) - len(activities))
+        return activities
+
+    except Exception as e:
+        print(f"Error processing .plt file {plt_file_path}: {e}")
+        return []
+
+
+# Activities with more trackpoints are not loaded
+MAX_TRACKPOINTS = 2500
+
+_worker_labels = {}
+
+def _parse_job(job):
+    # Runs in a worker process; labels are parsed once per user and cached for that process.
+    # With instrumentation on, the job's metrics go back to the parent with the result.
+    user_id, plt_file_path, labels_file, label_matching, instrumented = job
+    instruments = Instruments() if instrumented else NO_INSTRUMENTS
+    if labels_file not in _worker_labels:
+        with instruments.timer('parse_labels'):
+            _worker_labels[labels_file] = parse_labels(labels_file) if os.path.exists(labels_file) else LabelIndex()
+    activities = parse_plt_file(plt_file_path, _worker_labels[labels_file], label_matching, instruments)
+    return user_id, activities, instruments.snapshot() if instrumented else None
+
+
 # Tables
 user_table = """CREATE TABLE IF NOT EXISTS %s (
                            id VARCHAR(3) NOT NULL PRIMARY KEY,
@@ -179,15 +665,75 @@ trackpoint_table = """CREATE TABLE IF NOT EXISTS %s (
                                  longitude DOUBLE,
                                  altitude INT,
                                  date_time DATETIME,
+                                 grid_cell INT,
                                  FOREIGN KEY (activity_id) REFERENCES Activity(id) ON DELETE CASCADE)"""
 
+# Secondary indexes built by create_indexes after loading: (table, index name, columns)
+schema_indexes = [
+    ('TrackPoint', 'idx_trackpoint_activity_time', '(activity_id, date_time)'),
+    ('TrackPoint', 'idx_trackpoint_grid_cell', '(grid_cell, activity_id)'),
+    ('TrackPointSimplified', 'idx_simplified_activity_time', '(activity_id, date_time)'),
+    ('TrackPointSimplified', 'idx_simplified_grid_cell', '(grid_cell, activity_id)'),
+    ('Activity', 'idx_activity_user_start', '(user_id, start_date_time)'),
+    ('Activity', 'idx_activity_mode_user', '(transportation_mode, user_id)'),
+    ('Activity', 'idx_activity_start', '(start_date_time)'),
+    ('ActivitySummary', 'idx_summary_max_gap', '(max_gap_seconds, activity_id)'),
+]
+
 def main():
+    parser = argparse.ArgumentParser(description="Create the Geolife tables and load the dataset")
+    parser.add_argument('--data-directory', default="dataset/Data")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="number of parser processes; 0 loads serially on a single connection")
+    parser.add_argument('--writers', type=int, default=2, help="number of insert connections in parallel mode")
+    parser.add_argument('--loader', choices=['row', 'bulk'], default='row',
+                        help="row: per-activity INSERT and executemany, bulk: staged LOAD DATA LOCAL INFILE")
+    parser.add_argument('--label-matching', choices=['exact', 'segment'], default='exact',
+                        help="exact: a label must match the whole file, segment: one activity per overlapping label")
+    parser.add_argument('--full-reload', action='store_true',
+                        help="reload every file as if it had changed, replacing the activities the IngestManifest has for it")
+    parser.add_argument('--skip-indexes', action='store_true', help="do not build the secondary indexes after loading")
+    parser.add_argument('--partition-by-year', action='store_true',
+                        help="partition TrackPoint by year (drops its foreign key)")
+    parser.add_argument('--rebuild-summaries', action='store_true',
+                        help="recompute ActivitySummary from TrackPoint (for data loaded before the table existed)")
+    parser.add_argument('--simplify', type=float, metavar='METERS',
+                        help="also store every activity Douglas-Peucker simplified to this tolerance in TrackPointSimplified")
+    parser.add_argument('--simplified-only', action='store_true',
+                        help="with --simplify, store only the simplified tier and leave TrackPoint empty")
+    parser.add_argument('--instrument', action='store_true',
+                        help="time every loader stage and print a report at the end")
+    parser.add_argument('--profile', action='store_true', help="also run cProfile over the load (implies --instrument)")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="also record the peak memory with tracemalloc (implies --instrument)")
+    parser.add_argument('--metrics-output', help="write the timers, counters and profile to this JSON file")
+    args = parser.parse_args()
+    if args.simplified_only and not args.simplify:
+        parser.error("--simplified-only needs --simplify")
+    if args.workers > 0 and not 1 <= args.writers <= MAX_POOL_SIZE - 1:
+        parser.error(f"--writers must be between 1 and {MAX_POOL_SIZE - 1}, the writers and the main connection share one pool")
+    simplifier = TrackSimplifier(args.simplify) if args.simplify else None
+
+    # In parallel mode the main connection and the writers share one pool
+    pool_size = args.writers + 1 if args.workers > 0 else None
+    instruments = Instruments(enabled=args.instrument or args.profile or args.trace_memory or bool(args.metrics_output),
+                              profile=args.profile, trace_memory=args.trace_memory)
+
     processor = None
     try:
-        processor = GeolifeDataProcessor()
+        processor = GeolifeDataProcessor(loader=args.loader, label_matching=args.label_matching,
+                                         instruments=instruments, simplifier=simplifier,
+                                         store_raw=not args.simplified_only, POOL_SIZE=pool_size)
         processor.create_table(table_name="User", table_definition=user_table)
         processor.create_table(table_name="Activity", table_definition=activity_table)
         processor.create_table(table_name="TrackPoint", table_definition=trackpoint_table)
+        processor.create_table(table_name="TrackPointSimplified", table_definition=simplified_trackpoint_table)
+        processor.create_table(table_name="ActivitySummary", table_definition=activity_summary_table)
+        processor.create_table(table_name="IngestManifest", table_definition=manifest_table)
+        processor.create_table(table_name="DataVersion", table_definition=data_version_table)
+        processor.ensure_data_version_token()
+        # Before loading: the inserts write grid_cell, which tables from before the column lack
+        processor.ensure_grid_cells()
         processor.list_tables()
         processor.display_table(table_name="User")
         processor.display_table(table_name="Activity")
@@ -195,7 +741,24 @@ def main():
         processor.insert_user_table()
         processor.retrieve_data(table_name="User")
         print(f"Processing .plt files...")
-        processor.process_geolife_data(data_directory="dataset/Data")
+        with instruments.capture():
+            if args.workers > 0:
+                processor.process_geolife_data_parallel(args.data_directory, workers=args.workers, writers=args.writers,
+                                                        incremental=not args.full_reload)
+            else:
+                processor.process_geolife_data(data_directory=args.data_directory, incremental=not args.full_reload)
+        if args.rebuild_summaries:
+            with instruments.timer('rebuild_activity_summaries'):
+                processor.rebuild_activity_summaries()
+        if args.partition_by_year:
+            with instruments.timer('partition_trackpoints_by_year'):
+                processor.partition_trackpoints_by_year()
+        if not args.skip_indexes:
+            with instruments.timer('create_indexes'):
+                processor.create_indexes()
+        instruments.report()
+        if args.metrics_output:
+            instruments.dump(args.metrics_output)
         processor.display_top20_rows()
 
     except Exception as e:
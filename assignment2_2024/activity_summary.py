@@ -0,0 +1,83 @@
+import numpy as np
+from distance import haversine_km
+
+activity_summary_table = """CREATE TABLE IF NOT EXISTS %s (
+                               activity_id INT NOT NULL PRIMARY KEY,
+                               point_count INT,
+                               distance_km DOUBLE,
+                               altitude_gain INT,
+                               max_gap_seconds INT,
+                               duration_seconds INT,
+                               min_latitude DOUBLE,
+                               max_latitude DOUBLE,
+                               min_longitude DOUBLE,
+                               max_longitude DOUBLE,
+                               FOREIGN KEY (activity_id) REFERENCES Activity(id) ON DELETE CASCADE)"""
+
+SUMMARY_COLUMNS = ('activity_id', 'point_count', 'distance_km', 'altitude_gain', 'max_gap_seconds',
+                   'duration_seconds', 'min_latitude', 'max_latitude', 'min_longitude', 'max_longitude')
+
+INVALID_ALTITUDE = -777
+
+
+def summarize(latitudes, longitudes, altitudes, date_time):
+    """
+    Aggregates of one activity's trackpoints (in time order) as a tuple in SUMMARY_COLUMNS order,
+    without the activity id. altitudes are the integer values stored in TrackPoint; the gain only
+    counts rises between consecutive valid altitudes, like top_20_altitude_gains does in SQL.
+    """
+    distance = float(np.sum(haversine_km(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:])))
+    valid_altitudes = altitudes[altitudes > INVALID_ALTITUDE]
+    gain = int(np.sum(np.maximum(np.diff(valid_altitudes), 0)))
+    seconds = date_time.astype('datetime64[s]').astype(np.int64)
+    max_gap = int(np.max(np.diff(seconds))) if len(seconds) > 1 else 0
+    return (len(latitudes), distance, gain, max_gap, int(seconds[-1] - seconds[0]),
+            float(latitudes.min()), float(latitudes.max()), float(longitudes.min()), float(longitudes.max()))
+
+
+def summarize_track(track):
+    return summarize(track.latitude, track.longitude, np.trunc(track.altitude).astype(np.int64), track.date_time)
+
+
+def summarize_chunks(chunks):
+    """
+    Yields (activity_id,) + summary for chunks of (activity_id, latitude, longitude, altitude, date_time)
+    arrays ordered by activity and time, e.g. from stream_arrays. The trailing activity of a chunk
+    is held back until the next chunk shows where it ends.
+    """
+    carry = None
+    for chunk in chunks:
+        if carry is not None:
+            chunk = [np.concatenate((held, column)) for held, column in zip(carry, chunk)]
+        activity_ids = chunk[0]
+        starts = np.flatnonzero(np.r_[True, activity_ids[1:] != activity_ids[:-1]])
+        for first, stop in zip(starts[:-1], starts[1:]):
+            yield (int(activity_ids[first]),) + summarize(*(column[first:stop] for column in chunk[1:]))
+        carry = [column[starts[-1]:] for column in chunk]
+    if carry is not None:
+        yield (int(carry[0][0]),) + summarize(*carry[1:])
+
+
+def max_gaps(chunks):
+    """
+    Largest time gap in seconds between consecutive trackpoints of every activity, from chunks of
+    (activity_id, date_time) arrays ordered by activity and time, e.g. from stream_arrays. One
+    vectorized pass per chunk; the last point of a chunk is carried over to the next. Returns
+    {activity_id: max_gap_seconds}, 0 for activities with a single trackpoint, like summarize.
+    """
+    gaps = {}
+    last = None
+    for activity_ids, date_time in chunks:
+        if len(activity_ids) == 0:
+            continue
+        seconds = date_time.astype('datetime64[s]').astype(np.int64)
+        if last is not None:
+            activity_ids = np.concatenate(([last[0]], activity_ids))
+            seconds = np.concatenate(([last[1]], seconds))
+        deltas = np.zeros(len(seconds), dtype=np.int64)
+        deltas[1:] = np.where(activity_ids[1:] == activity_ids[:-1], np.diff(seconds), 0)
+        starts = np.flatnonzero(np.r_[True, activity_ids[1:] != activity_ids[:-1]])
+        for activity_id, gap in zip(activity_ids[starts].tolist(), np.maximum.reduceat(deltas, starts).tolist()):
+            gaps[activity_id] = max(gaps.get(activity_id, 0), gap)
+        last = (activity_ids[-1], seconds[-1])
+    return gaps
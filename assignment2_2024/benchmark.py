@@ -0,0 +1,284 @@
+"""
+Benchmarks for the Geolife loader. The loader benchmarks drop and recreate the tables, so point
+them at a scratch database, not the one holding the assignment data.
+
+    python3 benchmark.py loaders --data-directory dataset/Data --database benchdb
+    python3 benchmark.py parser --data-directory dataset/Data
+    python3 benchmark.py indexes --database benchdb   (on tables loaded by the loaders benchmark)
+    python3 benchmark.py backends --database benchdb --parquet-dir parquet
+    python3 benchmark.py suite --database benchdb --users 20 --files-per-user 50 --output results.json
+
+The suite generates a synthetic dataset (see synthetic.py) unless --data-directory points at one,
+runs every benchmark on it and writes the results as JSON so runs can be compared across versions.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from tabulate import tabulate
+from GeoLifeTask import GeolifeDataProcessor, iter_plt_files, parse_labels, user_table, activity_table, trackpoint_table
+from grid import grid_cells
+from label_index import LabelIndex
+from synthetic import generate_dataset
+from activity_summary import activity_summary_table
+from manifest import manifest_table
+from query_cache import data_version_table
+from simplify import simplified_trackpoint_table
+from plt_parser import read_plt
+from query import ANALYSES, GeolifeAnalysisTask
+
+
+def parse_plt_lines(plt_file_path):
+    # The per-line strptime parser the loader used before plt_parser, kept as the baseline
+    points = []
+    with open(plt_file_path, 'r') as file:
+        for line in file.readlines()[6:]:
+            lat, lon, _, altitude, _, date, time_of_day = line.strip().split(',')
+            date_time = datetime.strptime(f"{date.strip()} {time_of_day.strip()}", '%Y-%m-%d %H:%M:%S')
+            points.append((float(lat), float(lon), int(float(altitude)), date_time))
+    return points
+
+
+def bench_parser(data_directory, max_files=500):
+    paths = [path for _, path, _ in iter_plt_files(data_directory)][:max_files]
+    parsers = [('strptime lines', parse_plt_lines),
+               ('numpy, OLE days', lambda path: read_plt(path, time_source='days')),
+               ('numpy, date text', lambda path: read_plt(path, time_source='text'))]
+    results = []
+    for name, parse in parsers:
+        start = time.perf_counter()
+        for path in paths:
+            parse(path)
+        elapsed = time.perf_counter() - start
+        results.append({'parser': name, 'files': len(paths), 'ms_per_file': 1000 * elapsed / len(paths),
+                        'speedup': results[0]['ms_per_file'] / (1000 * elapsed / len(paths)) if results else 1.0})
+
+    print(tabulate([list(r.values()) for r in results], headers=list(results[0].keys()), tablefmt='grid'))
+    return results
+
+
+def reset_tables(processor):
+    for table_name in ('DataVersion', 'IngestManifest', 'ActivitySummary', 'TrackPointSimplified', 'TrackPoint',
+                       'Activity', 'User'):
+        processor.cursor.execute(f"DROP TABLE IF EXISTS {table_name}")
+    processor.create_table(table_name="User", table_definition=user_table)
+    processor.create_table(table_name="Activity", table_definition=activity_table)
+    processor.create_table(table_name="TrackPoint", table_definition=trackpoint_table)
+    processor.create_table(table_name="TrackPointSimplified", table_definition=simplified_trackpoint_table)
+    processor.create_table(table_name="ActivitySummary", table_definition=activity_summary_table)
+    processor.create_table(table_name="IngestManifest", table_definition=manifest_table)
+    processor.create_table(table_name="DataVersion", table_definition=data_version_table)
+
+
+def count_rows(processor):
+    processor.cursor.execute("SELECT (SELECT COUNT(*) FROM Activity), (SELECT COUNT(*) FROM TrackPoint)")
+    return processor.cursor.fetchone()
+
+
+def bench_loaders(data_directory, database, loaders=('row', 'bulk')):
+    labeled_ids_file = labeled_ids_path(data_directory)
+    results = []
+    for loader in loaders:
+        processor = GeolifeDataProcessor(loader=loader, DATABASE=database)
+        try:
+            reset_tables(processor)
+            processor.insert_user_table(labeled_ids_file)
+            start = time.perf_counter()
+            processor.process_geolife_data(data_directory)
+            elapsed = time.perf_counter() - start
+            activities, trackpoints = count_rows(processor)
+        finally:
+            processor.db_connector.close_connection()
+        results.append({'loader': loader, 'seconds': elapsed, 'activities': activities,
+                        'trackpoints': trackpoints, 'trackpoints_per_sec': trackpoints / elapsed})
+
+    print(tabulate([list(r.values()) for r in results], headers=list(results[0].keys()), tablefmt='grid'))
+    return results
+
+
+def time_analyses(task, analyses=ANALYSES):
+    # Seconds and result per analysis, with the printed answers swallowed
+    timings, results = {}, {}
+    for name in analyses:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            results[name] = getattr(task, name)()
+        timings[name] = time.perf_counter() - start
+    return timings, results
+
+
+def same_result(a, b):
+    # Equal up to float rounding; MySQL returns DECIMAL where pandas returns int or float
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(same_result(x, y) for x, y in zip(a, b))
+    try:
+        return abs(float(a) - float(b)) <= 1e-6 * max(1.0, abs(float(a)))
+    except (TypeError, ValueError):
+        return a == b
+
+
+def bench_indexes(database):
+    processor = GeolifeDataProcessor(DATABASE=database)
+    task = GeolifeAnalysisTask(DATABASE=database)
+    try:
+        processor.drop_indexes()
+        before, _ = time_analyses(task)
+        start = time.perf_counter()
+        processor.create_indexes()
+        build_seconds = time.perf_counter() - start
+        after, _ = time_analyses(task)
+    finally:
+        task.close_connection()
+        processor.db_connector.close_connection()
+
+    results = [{'query': name, 'seconds_without_indexes': before[name], 'seconds_with_indexes': after[name],
+                'speedup': before[name] / after[name]} for name in ANALYSES]
+    print(tabulate([list(r.values()) for r in results], headers=list(results[0].keys()), tablefmt='grid'))
+    print(f"Building the indexes took {build_seconds:.1f}s")
+    return results
+
+
+def bench_backends(database, parquet_dir):
+    from parquet_backend import ParquetAnalysisTask, export_parquet
+
+    export_parquet(parquet_dir, DATABASE=database)
+    task = GeolifeAnalysisTask(DATABASE=database)
+    try:
+        mysql_timings, mysql_results = time_analyses(task)
+    finally:
+        task.close_connection()
+    parquet_timings, parquet_results = time_analyses(ParquetAnalysisTask(parquet_dir))
+
+    results = [{'query': name, 'mysql_seconds': mysql_timings[name], 'parquet_seconds': parquet_timings[name],
+                'speedup': mysql_timings[name] / parquet_timings[name],
+                'same_result': same_result(mysql_results[name], parquet_results[name])} for name in ANALYSES]
+    print(tabulate([list(r.values()) for r in results], headers=list(results[0].keys()), tablefmt='grid'))
+    return results
+
+
+def labeled_ids_path(data_directory):
+    return os.path.join(os.path.dirname(os.path.normpath(data_directory)), 'labeled_ids.txt')
+
+
+def bench_process_plt_file(data_directory, database, max_files=200):
+    processor = GeolifeDataProcessor(DATABASE=database)
+    try:
+        reset_tables(processor)
+        processor.insert_user_table(labeled_ids_path(data_directory))
+        labels_by_user = {}
+        jobs = list(iter_plt_files(data_directory))[:max_files]
+        activities = 0
+        start = time.perf_counter()
+        for user_id, plt_file_path, labels_file in jobs:
+            if user_id not in labels_by_user:
+                labels_by_user[user_id] = parse_labels(labels_file) if os.path.exists(labels_file) else LabelIndex()
+            activities += len(processor.process_plt_file(plt_file_path, user_id, labels_by_user[user_id]))
+        elapsed = time.perf_counter() - start
+    finally:
+        processor.db_connector.close_connection()
+    result = {'files': len(jobs), 'activities': activities, 'seconds': elapsed, 'ms_per_file': 1000 * elapsed / len(jobs)}
+    print(f"process_plt_file: {result['ms_per_file']:.2f} ms/file over {len(jobs)} files ({activities} activities)")
+    return result
+
+
+def bench_batch_insert(data_directory, database, batch_sizes=(1000, 5000, 20000), max_files=20):
+    # Inserts the trackpoints of a few files under one throwaway activity, for each batch size
+    tracks = [read_plt(path) for _, path, _ in list(iter_plt_files(data_directory))[:max_files]]
+    points = [point for track in tracks for point in track.rows(grid_cells(track.latitude, track.longitude))]
+    processor = GeolifeDataProcessor(DATABASE=database)
+    results = []
+    try:
+        reset_tables(processor)
+        processor.cursor.execute("INSERT INTO User (id, has_label) VALUES ('000', false)")
+        for batch_size in batch_sizes:
+            activity_id = processor.insert_activity('000', 'walk', tracks[0].start_time(), tracks[-1].end_time())
+            trackpoints = [(activity_id,) + point for point in points]
+            start = time.perf_counter()
+            processor.batch_insert_trackpoints(trackpoints, batch_size=batch_size)
+            elapsed = time.perf_counter() - start
+            processor.cursor.execute("DELETE FROM Activity WHERE id = %s", (activity_id,))
+            processor.connection.commit()
+            results.append({'batch_size': batch_size, 'rows': len(trackpoints), 'seconds': elapsed,
+                            'rows_per_sec': len(trackpoints) / elapsed})
+    finally:
+        processor.db_connector.close_connection()
+    print(tabulate([list(r.values()) for r in results], headers=list(results[0].keys()), tablefmt='grid'))
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_suite(database, data_directory=None, output="benchmark_results.json", users=10, files_per_user=20,
+              points_per_file=500, label_density=0.5, seed=0):
+    with tempfile.TemporaryDirectory() as scratch:
+        scale = None
+        if data_directory is None:
+            scale = {'users': users, 'files_per_user': files_per_user, 'points_per_file': points_per_file,
+                     'label_density': label_density, 'seed': seed}
+            generate_dataset(scratch, users, files_per_user, points_per_file, label_density, seed=seed)
+            data_directory = os.path.join(scratch, 'Data')
+
+        results = {
+            'meta': {'revision': git_revision(), 'started_at': datetime.now().isoformat(timespec='seconds'),
+                     'python': platform.python_version(), 'data_directory': data_directory, 'synthetic_scale': scale},
+            'parser': bench_parser(data_directory),
+            'process_plt_file': bench_process_plt_file(data_directory, database),
+            'batch_insert_trackpoints': bench_batch_insert(data_directory, database),
+            'process_geolife_data': bench_loaders(data_directory, database),
+        }
+
+    # The queries run on what the last loader left in the database
+    task = GeolifeAnalysisTask(DATABASE=database)
+    try:
+        timings, _ = time_analyses(task)
+    finally:
+        task.close_connection()
+    results['queries'] = [{'query': name, 'seconds': seconds} for name, seconds in timings.items()]
+
+    with open(output, 'w') as file:
+        json.dump(results, file, indent=2, default=str)
+    print(f"Wrote benchmark results to {output}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Geolife loader benchmarks")
+    parser.add_argument('benchmark', choices=['loaders', 'parser', 'indexes', 'backends', 'suite'])
+    parser.add_argument('--data-directory', default=None, help="defaults to dataset/Data, the suite generates data instead")
+    parser.add_argument('--database', default="benchdb")
+    parser.add_argument('--parquet-dir', default="parquet")
+    parser.add_argument('--output', default="benchmark_results.json")
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--files-per-user', type=int, default=20)
+    parser.add_argument('--points-per-file', type=int, default=500)
+    parser.add_argument('--label-density', type=float, default=0.5)
+    args = parser.parse_args()
+    data_directory = args.data_directory or "dataset/Data"
+
+    if args.benchmark == 'loaders':
+        bench_loaders(data_directory, args.database)
+    elif args.benchmark == 'parser':
+        bench_parser(data_directory)
+    elif args.benchmark == 'indexes':
+        bench_indexes(args.database)
+    elif args.benchmark == 'backends':
+        bench_backends(args.database, args.parquet_dir)
+    elif args.benchmark == 'suite':
+        run_suite(args.database, args.data_directory, args.output, args.users, args.files_per_user,
+                  args.points_per_file, args.label_density)
+
+
+if __name__ == '__main__':
+    main()
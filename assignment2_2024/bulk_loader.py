@@ -0,0 +1,124 @@
+import os
+import tempfile
+import mysql.connector as mysql
+from activity_summary import SUMMARY_COLUMNS
+from simplify import SIMPLIFIED_COLUMNS
+
+# Errors raised when LOAD DATA LOCAL INFILE is disabled on the client or the server
+LOCAL_INFILE_ERRORS = {1148, 2068, 3948}
+
+ACTIVITY_COLUMNS = ('id', 'user_id', 'transportation_mode', 'start_date_time', 'end_date_time')
+TRACKPOINT_COLUMNS = ('activity_id', 'latitude', 'longitude', 'altitude', 'date_time', 'grid_cell')
+
+
+def format_value(value):
+    # Text form understood by LOAD DATA with the default escaping (\N is NULL)
+    if value is None:
+        return '\\N'
+    if hasattr(value, 'strftime'):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return str(value)
+
+
+class BulkLoader:
+    """
+    Stages Activity and TrackPoint rows in tab-separated buffers and bulk-loads them with
+    LOAD DATA LOCAL INFILE. If local infile is not allowed, it falls back to multi-row
+    INSERT ... VALUES statements. Activity ids must be assigned by the caller, so trackpoints
+    never wait for lastrowid.
+
+    Rows are only loaded by flush(), never in the middle of add(), so callers can flush at file
+    boundaries once is_full() says enough rows are staged. before_commit, if set, runs inside the
+    same transaction right before each commit.
+    """
+
+    def __init__(self, connection, cursor, flush_rows=200000, values_batch_size=5000, use_infile=True):
+        self.connection = connection
+        self.cursor = cursor
+        self.flush_rows = flush_rows
+        self.values_batch_size = values_batch_size
+        self.use_infile = use_infile
+        self.before_commit = None
+        self.activities = []
+        self.trackpoints = []
+        self.simplified = []
+        self.summaries = []
+
+    def add(self, activity_id, user_id, transportation_mode, start_time, end_time, points, summary=None,
+            simplified_points=None):
+        self.activities.append((activity_id, user_id, transportation_mode, start_time, end_time))
+        self.trackpoints.extend((activity_id,) + point for point in points)
+        if summary is not None:
+            self.summaries.append((activity_id,) + summary)
+        if simplified_points is not None:
+            self.simplified.extend((activity_id,) + point for point in simplified_points)
+
+    def checkpoint(self):
+        # Sizes of the buffers, for discard_since
+        return len(self.activities), len(self.trackpoints), len(self.simplified), len(self.summaries)
+
+    def discard_since(self, checkpoint):
+        # Drops the rows staged after checkpoint(), e.g. those of a file that failed halfway
+        activities, trackpoints, simplified, summaries = checkpoint
+        del self.activities[activities:]
+        del self.trackpoints[trackpoints:]
+        del self.simplified[simplified:]
+        del self.summaries[summaries:]
+
+    def is_full(self):
+        return len(self.trackpoints) + len(self.simplified) >= self.flush_rows
+
+    def flush(self):
+        try:
+            # Activities first, the trackpoints reference them
+            self.load_rows('Activity', ACTIVITY_COLUMNS, self.activities)
+            self.load_rows('TrackPoint', TRACKPOINT_COLUMNS, self.trackpoints)
+            self.load_rows('TrackPointSimplified', SIMPLIFIED_COLUMNS, self.simplified)
+            self.load_rows('ActivitySummary', SUMMARY_COLUMNS, self.summaries)
+            if self.before_commit:
+                self.before_commit()
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        finally:
+            self.activities = []
+            self.trackpoints = []
+            self.simplified = []
+            self.summaries = []
+
+    def load_rows(self, table_name, columns, rows):
+        if not rows:
+            return
+        if self.use_infile:
+            try:
+                self.load_infile(table_name, columns, rows)
+                return
+            except mysql.Error as e:
+                if e.errno not in LOCAL_INFILE_ERRORS:
+                    raise
+                print(f"LOAD DATA LOCAL INFILE is not available ({e}), using multi-row INSERT instead")
+                self.use_infile = False
+        self.insert_values(table_name, columns, rows)
+
+    def load_infile(self, table_name, columns, rows):
+        with tempfile.NamedTemporaryFile('w', suffix='.tsv', delete=False) as staged:
+            for row in rows:
+                staged.write('\t'.join(format_value(value) for value in row))
+                staged.write('\n')
+        try:
+            query = f"""
+            LOAD DATA LOCAL INFILE %s INTO TABLE {table_name}
+            FIELDS TERMINATED BY '\\t' LINES TERMINATED BY '\\n'
+            ({', '.join(columns)})
+            """
+            self.cursor.execute(query, (staged.name,))
+        finally:
+            os.remove(staged.name)
+
+    def insert_values(self, table_name, columns, rows):
+        placeholders = '(' + ', '.join(['%s'] * len(columns)) + ')'
+        for i in range(0, len(rows), self.values_batch_size):
+            batch = rows[i:i + self.values_batch_size]
+            query = f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES " + ', '.join([placeholders] * len(batch))
+            self.cursor.execute(query, [value for row in batch for value in row])
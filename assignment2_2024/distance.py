@@ -0,0 +1,56 @@
+from collections import defaultdict
+import numpy as np
+
+EARTH_RADIUS_KM = 6371
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    # Great-circle distance in kilometers, element-wise over NumPy arrays (or scalars)
+    lat1, lon1, lat2, lon2 = (np.radians(value) for value in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+
+def segment_distances(activity_ids, latitudes, longitudes):
+    """
+    Distance from the previous point for every point, 0 where the previous point belongs to
+    another activity (or for the first point). Points must be ordered by activity and time.
+    """
+    distances = np.zeros(len(latitudes))
+    if len(latitudes) > 1:
+        steps = haversine_km(latitudes[:-1], longitudes[:-1], latitudes[1:], longitudes[1:])
+        distances[1:] = np.where(activity_ids[1:] == activity_ids[:-1], steps, 0.0)
+    return distances
+
+
+class DistanceAccumulator:
+    """
+    Sums distances per activity over chunks of (activity_id, latitude, longitude) arrays, as
+    yielded by stream_arrays for a query ordered by activity_id, date_time. The last point of
+    each chunk is carried over, so the result does not depend on the chunk size.
+    """
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.last = None
+
+    def add(self, activity_ids, latitudes, longitudes):
+        if len(activity_ids) == 0:
+            return
+        if self.last is not None:
+            activity_ids = np.concatenate(([self.last[0]], activity_ids))
+            latitudes = np.concatenate(([self.last[1]], latitudes))
+            longitudes = np.concatenate(([self.last[2]], longitudes))
+
+        distances = segment_distances(activity_ids, latitudes, longitudes)
+        ids, inverse = np.unique(activity_ids, return_inverse=True)
+        for activity_id, total in zip(ids.tolist(), np.bincount(inverse, weights=distances).tolist()):
+            self.totals[activity_id] += total
+        self.last = (activity_ids[-1], latitudes[-1], longitudes[-1])
+
+    def group_totals(self, activity_keys):
+        # Sums the activity totals by the key activity_keys maps each activity to (user, mode, ...)
+        grouped = defaultdict(float)
+        for activity_id, total in self.totals.items():
+            grouped[activity_keys[activity_id]] += total
+        return dict(grouped)
@@ -0,0 +1,32 @@
+import math
+import numpy as np
+
+# Cells of 0.01 x 0.01 degrees (about 1.1 x 0.85 km around Beijing), numbered row by row from (-90, -180)
+CELLS_PER_DEGREE = 100
+GRID_COLUMNS = 360 * CELLS_PER_DEGREE
+METERS_PER_DEGREE_LATITUDE = 111320
+
+# The same formula in SQL, for filling grid_cell on rows loaded before the column existed
+GRID_CELL_SQL = f"""FLOOR((latitude + 90) * {CELLS_PER_DEGREE}) * {GRID_COLUMNS}
+                    + LEAST(FLOOR((longitude + 180) * {CELLS_PER_DEGREE}), {GRID_COLUMNS - 1})"""
+
+
+def grid_cells(latitudes, longitudes):
+    rows = np.floor((np.asarray(latitudes) + 90) * CELLS_PER_DEGREE).astype(np.int64)
+    columns = np.minimum(np.floor((np.asarray(longitudes) + 180) * CELLS_PER_DEGREE).astype(np.int64), GRID_COLUMNS - 1)
+    return rows * GRID_COLUMNS + columns
+
+
+def cell_ranges(min_lat, min_lon, max_lat, max_lon):
+    # Inclusive (first, last) cell id ranges covering the box, one per grid row
+    first_row, first_column = divmod(int(grid_cells(min_lat, min_lon)), GRID_COLUMNS)
+    last_row, last_column = divmod(int(grid_cells(max_lat, max_lon)), GRID_COLUMNS)
+    return [(row * GRID_COLUMNS + first_column, row * GRID_COLUMNS + last_column)
+            for row in range(first_row, last_row + 1)]
+
+
+def radius_bbox(lat, lon, radius_m):
+    # Box containing every point within radius_m of (lat, lon)
+    d_lat = radius_m / METERS_PER_DEGREE_LATITUDE
+    d_lon = radius_m / (METERS_PER_DEGREE_LATITUDE * max(math.cos(math.radians(lat)), 1e-6))
+    return lat - d_lat, lon - d_lon, lat + d_lat, lon + d_lon
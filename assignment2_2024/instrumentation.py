@@ -0,0 +1,242 @@
+"""
+Timers, counters and histograms for the loader and the queries.
+
+    instruments = Instruments()
+    with instruments.timer('read_plt'):
+        track = read_plt(path)
+    instruments.count('trackpoints', track.size)
+    instruments.observe('points_per_activity', track.size)
+    instruments.report()
+    instruments.dump('metrics.json')
+
+A disabled Instruments (NO_INSTRUMENTS, the default everywhere) returns a shared no-op timer and
+returns from count/observe right away, so the calls can stay in the hot paths. profile=True adds
+a cProfile of the run and trace_memory=True the tracemalloc peak and top allocation sites.
+"""
+from contextlib import contextmanager
+import cProfile
+import io
+import json
+import math
+import pstats
+import threading
+import time
+import tracemalloc
+from tabulate import tabulate
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ('instruments', 'name', 'start')
+
+    def __init__(self, instruments, name):
+        self.instruments = instruments
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.instruments.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Histogram:
+    """Count, sum, min and max of the samples, plus counts per power-of-two bucket for percentiles."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.buckets = {}
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        # Bucket e holds the values in [2**(e-1), 2**e); zero and negative values go to bucket None
+        bucket = math.frexp(value)[1] if value > 0 else None
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def merge(self, data):
+        self.count += data['count']
+        self.total += data['total']
+        self.min = min(self.min, data['min'])
+        self.max = max(self.max, data['max'])
+        for bucket, count in data['buckets']:
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the percentile, capped at the largest sample
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.buckets, key=lambda b: -math.inf if b is None else b):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return 0.0 if bucket is None else min(2.0 ** bucket, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {'count': self.count, 'total': self.total, 'min': self.min, 'max': self.max,
+                'mean': self.total / self.count if self.count else None,
+                'p50': self.percentile(0.5), 'p95': self.percentile(0.95), 'p99': self.percentile(0.99),
+                'buckets': sorted(self.buckets.items(), key=lambda item: -math.inf if item[0] is None else item[0])}
+
+
+class Instruments:
+    """
+    Thread-safe collection of timers (seconds), counters and histograms, keyed by stage name.
+    Writer threads of the parallel loader share one instance; worker processes send theirs back
+    with snapshot() and the parent adds them with merge().
+    """
+
+    def __init__(self, enabled=True, profile=False, trace_memory=False):
+        self.enabled = enabled
+        self.profile = profile and enabled
+        self.trace_memory = trace_memory and enabled
+        self.timers = {}
+        self.counters = {}
+        self.histograms = {}
+        self.lock = threading.Lock()
+        self.profiler = None
+        self.started_at = None
+        self.memory = None
+
+    def timer(self, name):
+        if not self.enabled:
+            return NULL_TIMER
+        return _Timer(self, name)
+
+    def record(self, name, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.timers.get(name)
+            if histogram is None:
+                histogram = self.timers[name] = Histogram()
+            histogram.add(seconds)
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        if not self.enabled:
+            return
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.add(value)
+
+    @contextmanager
+    def capture(self):
+        """Runs the with-block under cProfile and tracemalloc when enabled, and times it as 'total'."""
+        self.start()
+        try:
+            with self.timer('total'):
+                yield self
+        finally:
+            self.stop()
+
+    def start(self):
+        if not self.enabled:
+            return
+        self.started_at = time.time()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stop(self):
+        if self.profiler:
+            self.profiler.disable()
+        if self.trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            top = tracemalloc.take_snapshot().statistics('lineno')[:20]
+            self.memory = {'current_bytes': current, 'peak_bytes': peak,
+                           'top': [{'location': str(stat.traceback), 'bytes': stat.size, 'blocks': stat.count}
+                                   for stat in top]}
+            tracemalloc.stop()
+
+    def snapshot(self):
+        with self.lock:
+            return {'timers': {name: histogram.to_dict() for name, histogram in self.timers.items()},
+                    'counters': dict(self.counters),
+                    'histograms': {name: histogram.to_dict() for name, histogram in self.histograms.items()}}
+
+    def merge(self, snapshot):
+        if not self.enabled or not snapshot:
+            return
+        with self.lock:
+            for kind, target in (('timers', self.timers), ('histograms', self.histograms)):
+                for name, data in snapshot[kind].items():
+                    target.setdefault(name, Histogram()).merge(data)
+            for name, value in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def profile_stats(self, limit=30):
+        # Top functions by cumulative time, as (function, calls, total seconds, cumulative seconds)
+        if not self.profiler:
+            return []
+        stats = pstats.Stats(self.profiler, stream=io.StringIO())
+        rows = []
+        for (filename, line, function), (_, calls, total, cumulative, _) in stats.stats.items():
+            rows.append({'function': f"{filename}:{line}({function})", 'calls': calls,
+                         'total': total, 'cumulative': cumulative})
+        return sorted(rows, key=lambda row: row['cumulative'], reverse=True)[:limit]
+
+    def report(self):
+        if not self.enabled:
+            return
+        snapshot = self.snapshot()
+        rows = [(name, data['count'], data['total'], 1000 * data['mean'], 1000 * data['p50'], 1000 * data['p95'],
+                 1000 * data['max'])
+                for name, data in sorted(snapshot['timers'].items(), key=lambda item: -item[1]['total'])]
+        print("Timers:")
+        print(tabulate(rows, headers=['Stage', 'Calls', 'Total (s)', 'Mean (ms)', 'p50 (ms)', 'p95 (ms)', 'Max (ms)'],
+                       tablefmt='grid', floatfmt='.3f'))
+        if snapshot['counters']:
+            print("Counters:")
+            print(tabulate(sorted(snapshot['counters'].items()), headers=['Counter', 'Value'], tablefmt='grid'))
+        if snapshot['histograms']:
+            rows = [(name, data['count'], data['mean'], data['p50'], data['p95'], data['max'])
+                    for name, data in sorted(snapshot['histograms'].items())]
+            print("Histograms:")
+            print(tabulate(rows, headers=['Name', 'Samples', 'Mean', 'p50', 'p95', 'Max'], tablefmt='grid'))
+        if self.profiler:
+            rows = [(row['function'], row['calls'], row['total'], row['cumulative']) for row in self.profile_stats(15)]
+            print("Profile (top 15 by cumulative time):")
+            print(tabulate(rows, headers=['Function', 'Calls', 'Total (s)', 'Cumulative (s)'], tablefmt='grid'))
+        if self.memory:
+            print(f"Memory: peak {self.memory['peak_bytes'] / 2 ** 20:.1f} MiB traced by tracemalloc")
+
+    def dump(self, path):
+        if not self.enabled:
+            return
+        result = dict(self.snapshot(), started_at=self.started_at, profile=self.profile_stats(), memory=self.memory)
+        with open(path, 'w') as file:
+            json.dump(result, file, indent=2)
+
+
+NO_INSTRUMENTS = Instruments(enabled=False)
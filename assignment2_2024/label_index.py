@@ -0,0 +1,63 @@
+from bisect import bisect_right
+import numpy as np
+
+
+class LabelIndex:
+    """
+    Index over the (start_time, end_time, mode) labels of one user.
+
+    Exact (start, end) matches are a dict lookup. Overlap and containment queries use the labels
+    sorted by start time together with a running maximum of the end times, so they only visit
+    the labels that can match instead of scanning all of them.
+    """
+
+    def __init__(self, labels=()):
+        self.labels = sorted(labels, key=lambda label: (label[0], label[1]))
+        self.exact = {}
+        for start_time, end_time, mode in labels:
+            # The first label in the file wins, like the old linear scan
+            self.exact.setdefault((start_time, end_time), mode)
+
+        self.starts = [label[0] for label in self.labels]
+        self.max_ends = []
+        for _, end_time, _ in self.labels:
+            self.max_ends.append(max(end_time, self.max_ends[-1]) if self.max_ends else end_time)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __iter__(self):
+        return iter(self.labels)
+
+    def match(self, start_time, end_time):
+        return self.exact.get((start_time, end_time))
+
+    def overlapping(self, start_time, end_time):
+        # Labels sharing at least one instant with [start_time, end_time], in start order
+        result = []
+        i = bisect_right(self.starts, end_time) - 1
+        while i >= 0 and self.max_ends[i] >= start_time:
+            if self.labels[i][1] >= start_time:
+                result.append(self.labels[i])
+            i -= 1
+        result.reverse()
+        return result
+
+    def containing(self, start_time, end_time):
+        return [label for label in self.overlapping(start_time, end_time)
+                if label[0] <= start_time and label[1] >= end_time]
+
+    def segments(self, date_time):
+        """
+        Splits a sorted datetime64 array by label: returns (mode, first, stop) for every label
+        covering at least one timestamp, where date_time[first:stop] are the covered points.
+        """
+        if len(date_time) == 0:
+            return []
+        segments = []
+        for start_time, end_time, mode in self.overlapping(date_time[0].item(), date_time[-1].item()):
+            first = np.searchsorted(date_time, np.datetime64(start_time, 's'), side='left')
+            stop = np.searchsorted(date_time, np.datetime64(end_time, 's'), side='right')
+            if stop > first:
+                segments.append((mode, int(first), int(stop)))
+        return segments
@@ -0,0 +1,123 @@
+import hashlib
+import os
+
+manifest_table = """CREATE TABLE IF NOT EXISTS %s (
+                               path VARCHAR(255) NOT NULL PRIMARY KEY,
+                               size BIGINT,
+                               mtime DOUBLE,
+                               checksum CHAR(40),
+                               labels_checksum CHAR(40),
+                               label_matching VARCHAR(10),
+                               first_activity_id INT,
+                               activity_count INT,
+                               loaded_at DATETIME)"""
+
+
+def file_checksum(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class IngestManifest:
+    """
+    Records every loaded .plt file (path relative to the data directory, size, mtime, SHA-1 and
+    the range of activity ids it produced) so a rerun only loads new or changed files. A file's
+    activities also depend on its user's labels.txt and on the label matching mode, so the SHA-1
+    of labels.txt and the mode are recorded too and a change in either reloads the file.
+
+    Entries are not written right away: record() queues them and apply() writes them, together
+    with the deletion of the activities a changed file had before, on the caller's cursor. The
+    caller commits them in the same transaction as the file's new rows, so after a crash a file
+    is either fully loaded and recorded or not recorded at all.
+    """
+
+    def __init__(self, cursor, table_name='IngestManifest'):
+        self.cursor = cursor
+        self.table_name = table_name
+        self.data_directory = None
+        self.label_matching = None
+        self.entries = {}
+        self.labels_checksums = {}
+        self.pending = []
+
+    def load(self, data_directory, label_matching):
+        self.data_directory = data_directory
+        self.label_matching = label_matching
+        self.labels_checksums = {}
+        self.ensure_label_columns()
+        self.cursor.execute(f"""
+        SELECT path, size, mtime, checksum, first_activity_id, activity_count, labels_checksum, label_matching
+        FROM {self.table_name}
+        """)
+        self.entries = {row[0]: row[1:] for row in self.cursor.fetchall()}
+
+    def ensure_label_columns(self):
+        # Manifests written before the labels were recorded get the columns; their files reload once
+        self.cursor.execute("""
+        SELECT COUNT(*) FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND COLUMN_NAME = 'labels_checksum'
+        """, (self.table_name,))
+        if self.cursor.fetchone()[0] == 0:
+            self.cursor.execute(f"""
+            ALTER TABLE {self.table_name}
+            ADD COLUMN labels_checksum CHAR(40) AFTER checksum,
+            ADD COLUMN label_matching VARCHAR(10) AFTER labels_checksum
+            """)
+
+    def labels_checksum(self, labels_file):
+        # SHA-1 of a user's labels.txt, None without one; computed once per user and run
+        if labels_file not in self.labels_checksums:
+            self.labels_checksums[labels_file] = file_checksum(labels_file) if os.path.exists(labels_file) else None
+        return self.labels_checksums[labels_file]
+
+    def check(self, path, labels_file, force=False):
+        """
+        Returns None if the file is loaded and unchanged, else a dict describing it for record().
+        Size and mtime are compared first; the checksum is only computed when they differ. The file
+        counts as changed whenever its labels.txt or the label matching mode differ from the entry.
+        With force=True every file counts as changed, so a full reload still replaces the activities
+        the files had before and records the new ones.
+        """
+        key = os.path.relpath(path, self.data_directory).replace(os.sep, '/')
+        stat = os.stat(path)
+        labels = (self.labels_checksum(labels_file), self.label_matching)
+        entry = self.entries.get(key)
+        same_labels = not force and entry is not None and tuple(entry[5:]) == labels
+        if same_labels and entry[0] == stat.st_size and entry[1] == stat.st_mtime:
+            return None
+
+        info = {'key': key, 'size': stat.st_size, 'mtime': stat.st_mtime, 'checksum': file_checksum(path),
+                'labels_checksum': labels[0], 'label_matching': labels[1], 'previous': None}
+        if entry:
+            size, mtime, checksum, first_activity_id, activity_count, _, _ = entry
+            if same_labels and checksum == info['checksum']:
+                # Touched but not changed: only refresh the stat so the next run takes the fast path
+                self.pending.append((info, first_activity_id, activity_count))
+                return None
+            info['previous'] = (first_activity_id, activity_count)
+        return info
+
+    def record(self, info, activity_ids):
+        first_activity_id = min(activity_ids) if activity_ids else None
+        self.pending.append((info, first_activity_id, len(activity_ids)))
+
+    def apply(self):
+        for info, first_activity_id, activity_count in self.pending:
+            if info['previous'] and info['previous'][1]:
+                previous_ids = (info['previous'][0], info['previous'][0] + info['previous'][1] - 1)
+                # TrackPoint is deleted explicitly, a partitioned TrackPoint has no ON DELETE CASCADE
+                self.cursor.execute("DELETE FROM TrackPoint WHERE activity_id BETWEEN %s AND %s", previous_ids)
+                self.cursor.execute("DELETE FROM Activity WHERE id BETWEEN %s AND %s", previous_ids)
+            self.cursor.execute(f"""
+            REPLACE INTO {self.table_name}
+            (path, size, mtime, checksum, labels_checksum, label_matching, first_activity_id, activity_count, loaded_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW())
+            """, (info['key'], info['size'], info['mtime'], info['checksum'], info['labels_checksum'],
+                  info['label_matching'], first_activity_id, activity_count))
+        self.pending = []
+
+    def discard(self):
+        self.pending = []
@@ -0,0 +1,235 @@
+"""
+Offline copy of the database as Parquet, and a GeolifeAnalysisTask backend that answers the
+Part 2 questions from it with pandas/pyarrow, without a MySQL server.
+
+    python3 parquet_backend.py export --directory parquet
+    python3 query.py --backend parquet --parquet-dir parquet
+
+Layout: user.parquet, activity.parquet and trackpoint/user_id=<id>/year=<year>/*.parquet, where
+year is the start year of the activity, so an activity never spans two partitions.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, ROUND_HALF_UP
+import argparse
+import os
+import shutil
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from tabulate import tabulate
+from DbConnector import DbConnector
+from activity_summary import max_gaps
+from distance import DistanceAccumulator
+from streaming import stream_arrays
+
+TRACKPOINT_COLUMNS = ['id', 'activity_id', 'latitude', 'longitude', 'altitude', 'date_time']
+
+
+def export_parquet(directory, chunk_size=500000, **db_config):
+    connector = DbConnector(**db_config)
+    try:
+        # write_to_dataset only overwrites chunk files of the same name, so a previous export's
+        # files would stay in the partitions; start from an empty copy instead
+        shutil.rmtree(os.path.join(directory, 'trackpoint'), ignore_errors=True)
+        for filename in ('user.parquet', 'activity.parquet'):
+            if os.path.exists(os.path.join(directory, filename)):
+                os.remove(os.path.join(directory, filename))
+        os.makedirs(directory, exist_ok=True)
+        connector.cursor.execute("SELECT id, has_label FROM User ORDER BY id")
+        users = pd.DataFrame(connector.cursor.fetchall(), columns=['id', 'has_label'])
+        users.to_parquet(os.path.join(directory, 'user.parquet'), index=False)
+
+        connector.cursor.execute("""
+        SELECT id, user_id, transportation_mode, start_date_time, end_date_time
+        FROM Activity ORDER BY id
+        """)
+        activities = pd.DataFrame(connector.cursor.fetchall(),
+                                  columns=['id', 'user_id', 'transportation_mode', 'start_date_time', 'end_date_time'])
+        activities.to_parquet(os.path.join(directory, 'activity.parquet'), index=False)
+
+        query = """
+        SELECT T.id, T.activity_id, T.latitude, T.longitude, T.altitude, T.date_time,
+               A.user_id, YEAR(A.start_date_time)
+        FROM TrackPoint T
+        JOIN Activity A ON T.activity_id = A.id
+        ORDER BY T.id
+        """
+        dtypes = (np.int64, np.int64, float, float, np.int64, 'datetime64[s]', str, np.int64)
+        rows = 0
+        for number, columns in enumerate(stream_arrays(connector.db_connection, query, (), dtypes, chunk_size)):
+            table = pa.table(dict(zip(TRACKPOINT_COLUMNS + ['user_id', 'year'], columns)))
+            pq.write_to_dataset(table, os.path.join(directory, 'trackpoint'), partition_cols=['user_id', 'year'],
+                                basename_template=f"chunk{number:05d}-{{i}}.parquet")
+            rows += table.num_rows
+        print(f"Exported {len(users)} users, {len(activities)} activities and {rows} trackpoints to {directory}")
+    finally:
+        connector.close_connection()
+
+
+class ParquetAnalysisTask:
+    """
+    Same questions and results as GeolifeAnalysisTask, computed in-process from export_parquet
+    output. Per-partition work runs on a thread pool, so it scales with the local cores.
+    """
+
+    def __init__(self, directory, workers=None):
+        self.directory = directory
+        self.workers = workers or os.cpu_count()
+        self.users = pd.read_parquet(os.path.join(directory, 'user.parquet'))
+        self.activities = pd.read_parquet(os.path.join(directory, 'activity.parquet'))
+        # Explicit schema, otherwise user ids like '010' would be read back as the integer 10
+        partitioning = ds.partitioning(pa.schema([('user_id', pa.string()), ('year', pa.int64())]), flavor='hive')
+        self.trackpoints = ds.dataset(os.path.join(directory, 'trackpoint'), format='parquet', partitioning=partitioning)
+
+    def partition_paths(self, user_id=None, year=None):
+        root = os.path.join(self.directory, 'trackpoint')
+        paths = []
+        for user_dir in sorted(os.listdir(root)):
+            if user_id is not None and user_dir != f"user_id={user_id}":
+                continue
+            for year_dir in sorted(os.listdir(os.path.join(root, user_dir))):
+                if year is None or year_dir == f"year={year}":
+                    paths.append((user_dir.split('=', 1)[1], os.path.join(root, user_dir, year_dir)))
+        return paths
+
+    def map_partitions(self, function, columns, **partition_filter):
+        # Runs function(user_id, DataFrame) on every (user, year) partition in parallel
+        def run(partition):
+            user_id, path = partition
+            return function(user_id, pq.read_table(path, columns=columns).to_pandas())
+        with ThreadPoolExecutor(self.workers) as executor:
+            return list(executor.map(run, self.partition_paths(**partition_filter)))
+
+    def count_entries(self):
+        user_count, activity_count = len(self.users), len(self.activities)
+        trackpoint_count = self.trackpoints.count_rows()
+        print(f"Users: {user_count}, Activities: {activity_count}, TrackPoints: {trackpoint_count}")
+        return user_count, activity_count, trackpoint_count
+
+    def average_activities_per_user(self):
+        # MySQL division gives a DECIMAL with 4 decimals
+        avg_activities = (Decimal(len(self.activities)) / Decimal(len(self.users))).quantize(Decimal('0.0001'), ROUND_HALF_UP)
+        print(f"Average number of activities per user: {avg_activities}")
+        return avg_activities
+
+    def top_20_users(self):
+        counts = self.activities.groupby('user_id').size().reset_index(name='activity_count')
+        counts = counts.sort_values(['activity_count', 'user_id'], ascending=[False, True]).head(20)
+        result = list(counts.itertuples(index=False, name=None))
+        print("Top 20 users with the highest number of activities:")
+        print(tabulate(result, headers=['User ID', 'Activity Count'], tablefmt='grid'))
+        return result
+
+    def users_taken_taxi(self):
+        users = [(user_id,) for user_id in sorted(self.activities.loc[self.activities.transportation_mode == 'taxi', 'user_id'].unique())]
+        print("Users who have taken a taxi:")
+        print(tabulate(users, headers=['User ID'], tablefmt='grid'))
+        return users
+
+    def count_transportation_modes(self):
+        counts = self.activities.dropna(subset=['transportation_mode']).groupby('transportation_mode').size()
+        counts = counts.reset_index(name='activity_count').sort_values(['activity_count', 'transportation_mode'], ascending=[False, True])
+        modes = list(counts.itertuples(index=False, name=None))
+        print("Transportation modes and their activity counts:")
+        print(tabulate(modes, headers=['Mode', 'Activity Count'], tablefmt='grid'))
+        return modes
+
+    def year_with_most_activities(self):
+        counts = self.activities.groupby(self.activities.start_date_time.dt.year).size().reset_index(name='activity_count')
+        counts.columns = ['year', 'activity_count']
+        result = tuple(counts.sort_values(['activity_count', 'year'], ascending=[False, True]).iloc[0].tolist())
+        print(f"Year with the most activities: {result[0]} ({result[1]} activities)")
+        return result
+
+    def year_with_most_recorded_hours(self):
+        # Whole hours per activity, like TIMESTAMPDIFF(HOUR, ...)
+        seconds = (self.activities.end_date_time - self.activities.start_date_time).dt.total_seconds()
+        hours = pd.DataFrame({'year': self.activities.start_date_time.dt.year, 'total_hours': np.trunc(seconds / 3600).astype(np.int64)})
+        totals = hours.groupby('year', as_index=False).total_hours.sum()
+        result = tuple(totals.sort_values(['total_hours', 'year'], ascending=[False, True]).iloc[0].tolist())
+        print(f"Year with the most recorded hours: {result[0]} ({result[1]} hours)")
+        return result
+
+    def total_distance_walked_2008(self, user_id='112'):
+        activities = self.activities
+        ids = activities.loc[(activities.user_id == user_id) & (activities.transportation_mode == 'walk')
+                             & (activities.start_date_time.dt.year == 2008), 'id']
+        accumulator = DistanceAccumulator()
+        for _, path in self.partition_paths(user_id=user_id, year=2008):
+            points = pq.read_table(path, columns=['id', 'activity_id', 'latitude', 'longitude', 'date_time']).to_pandas()
+            points = points[points.activity_id.isin(ids)].sort_values(['activity_id', 'date_time', 'id'])
+            accumulator.add(points.activity_id.to_numpy(), points.latitude.to_numpy(), points.longitude.to_numpy())
+        total_distance = sum(accumulator.totals.values())
+        print(f"Total distance walked by user {user_id} in 2008: {total_distance:.2f} km")
+        return total_distance
+
+    def top_20_altitude_gains(self):
+        def gains(user_id, points):
+            # Rises between consecutive valid altitudes of the same activity, in id order
+            points = points[points.altitude > -777].sort_values(['activity_id', 'id'])
+            rises = points.groupby('activity_id').altitude.diff().clip(lower=0)
+            return user_id, int(rises.sum())
+
+        totals = pd.DataFrame(self.map_partitions(gains, ['id', 'activity_id', 'altitude']), columns=['user_id', 'total_altitude_gain'])
+        totals = totals.groupby('user_id', as_index=False).total_altitude_gain.sum()
+        totals = totals.sort_values(['total_altitude_gain', 'user_id'], ascending=[False, True]).head(20)
+        result = list(totals.itertuples(index=False, name=None))
+        print("Top 20 users with the highest altitude gain:")
+        print(tabulate(result, headers=['User ID', 'Total Gain (meters)'], tablefmt='grid'))
+        return result
+
+    def find_invalid_activities(self, gap_minutes=5):
+        # Activities with two consecutive trackpoints gap_minutes or more apart, like GeolifeAnalysisTask
+        def invalid(user_id, points):
+            points = points.sort_values(['activity_id', 'date_time', 'id'])
+            gaps = max_gaps([(points.activity_id.to_numpy(), points.date_time.to_numpy())])
+            return user_id, sum(gap >= gap_minutes * 60 for gap in gaps.values())
+
+        counts = pd.DataFrame(self.map_partitions(invalid, ['id', 'activity_id', 'date_time']),
+                              columns=['user_id', 'invalid_activities'])
+        counts = counts.groupby('user_id', as_index=False).invalid_activities.sum()
+        result = [(user_id, int(count)) for user_id, count in counts.itertuples(index=False, name=None) if count > 0]
+        print("Users with invalid activities:")
+        print(tabulate(result, headers=['User ID', 'Invalid Activities'], tablefmt='grid'))
+        return result
+
+    def users_in_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        inside = ((ds.field('latitude') >= min_lat) & (ds.field('latitude') <= max_lat)
+                  & (ds.field('longitude') >= min_lon) & (ds.field('longitude') <= max_lon))
+        user_ids = self.trackpoints.to_table(columns=['user_id'], filter=inside).column('user_id')
+        return sorted(set(str(user_id) for user_id in user_ids.to_pylist()))
+
+    def find_users_in_forbidden_city(self):
+        result = [(user_id,) for user_id in self.users_in_bbox(39.916 - 0.005, 116.397 - 0.005, 39.916 + 0.005, 116.397 + 0.005)]
+        print("Users who have tracked an activity in the Forbidden City:")
+        print(tabulate(result, headers=['User ID'], tablefmt='grid'))
+        return result
+
+    def find_most_used_transport_mode(self):
+        counts = self.activities.dropna(subset=['transportation_mode']).groupby(['user_id', 'transportation_mode']).size()
+        counts = counts.reset_index(name='mode_count').sort_values(['user_id', 'mode_count', 'transportation_mode'],
+                                                                   ascending=[True, False, True])
+        formatted_result = list(counts.drop_duplicates('user_id')[['user_id', 'transportation_mode']].itertuples(index=False, name=None))
+        print("Users and their most used transportation mode:")
+        print(tabulate(formatted_result, headers=['User ID', 'Most Used Mode'], tablefmt='grid'))
+        return formatted_result
+
+    def close_connection(self):
+        # Nothing to close, kept so the backends are interchangeable
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the Geolife tables to Parquet")
+    parser.add_argument('command', choices=['export'])
+    parser.add_argument('--directory', default="parquet")
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        export_parquet(args.directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+from collections import namedtuple
+import os
+import numpy as np
+
+HEADER_LINES = 6
+
+# Column 5 of a .plt line is the number of days since 1899-12-30 (OLE automation date)
+OLE_EPOCH = np.datetime64('1899-12-30T00:00:00', 's')
+SECONDS_PER_DAY = 86400
+
+
+class PltTrack(namedtuple('PltTrack', ['latitude', 'longitude', 'altitude', 'date_time'])):
+    """
+    Columns of one .plt file: float64 arrays for latitude, longitude and altitude (feet, as in
+    the file) and a datetime64[s] array of timestamps.
+    """
+    __slots__ = ()
+
+    @property
+    def size(self):
+        return len(self.latitude)
+
+    def start_time(self):
+        return self.date_time[0].item()
+
+    def end_time(self):
+        return self.date_time[-1].item()
+
+    def slice(self, first, stop):
+        return PltTrack(*(column[first:stop] for column in self))
+
+    def rows(self, *extra_columns):
+        # (latitude, longitude, altitude, date_time, *extra) tuples in the form the TrackPoint table takes
+        return list(zip(self.latitude.tolist(), self.longitude.tolist(),
+                        self.altitude.astype(np.int64).tolist(), self.date_time.tolist(),
+                        *(np.asarray(column).tolist() for column in extra_columns)))
+
+
+def count_points(plt_file_path, limit=None):
+    """
+    Number of trackpoint lines in a .plt file, counted in binary chunks. With limit, reading stops
+    as soon as the file is known to hold more than limit points and limit + 1 is returned, so an
+    oversize file is rejected after reading about limit lines instead of all of it.
+    """
+    stop = None if limit is None else HEADER_LINES + limit + 1
+    lines, last = 0, b'\n'
+    with open(plt_file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 16), b''):
+            lines += chunk.count(b'\n')
+            last = chunk[-1:]
+            if stop is not None and lines >= stop:
+                return limit + 1
+    if last != b'\n':
+        lines += 1  # Last line without a newline
+    return max(lines - HEADER_LINES, 0)
+
+
+def time_bounds(plt_file_path):
+    """
+    (start_time, end_time) of a .plt file from its first and last trackpoint line only, the same
+    values read_plt(...).start_time() and end_time() give. None if the file has no trackpoints.
+    """
+    with open(plt_file_path, 'rb') as file:
+        for _ in range(HEADER_LINES):
+            file.readline()
+        first = file.readline().strip()
+        if not first:
+            return None
+        # The last line is within the last few hundred bytes
+        file.seek(0, os.SEEK_END)
+        file.seek(max(file.tell() - 512, 0))
+        last = file.read().strip().rsplit(b'\n', 1)[-1]
+
+    days = np.array([float(first.split(b',')[4]), float(last.split(b',')[4])])
+    start_time, end_time = OLE_EPOCH + np.rint(days * SECONDS_PER_DAY).astype(np.int64).astype('timedelta64[s]')
+    return start_time.item(), end_time.item()
+
+
+def read_plt(plt_file_path, time_source='days'):
+    """
+    Reads a whole .plt file into a PltTrack in one pass, without building a Python object per line.
+
+    time_source='days' converts the OLE day count in column 5 to timestamps; time_source='text'
+    parses the date and time columns instead (vectorized, no strptime). Both give whole seconds.
+    """
+    if time_source == 'days':
+        columns = np.loadtxt(plt_file_path, delimiter=',', skiprows=HEADER_LINES, usecols=(0, 1, 3, 4), ndmin=2)
+        seconds = np.rint(columns[:, 3] * SECONDS_PER_DAY).astype(np.int64)
+        date_time = OLE_EPOCH + seconds.astype('timedelta64[s]')
+    elif time_source == 'text':
+        columns = np.loadtxt(plt_file_path, delimiter=',', skiprows=HEADER_LINES, usecols=(0, 1, 3), ndmin=2)
+        text = np.loadtxt(plt_file_path, delimiter=',', skiprows=HEADER_LINES, usecols=(5, 6), dtype=str, ndmin=2)
+        date_time = np.char.add(np.char.add(np.char.strip(text[:, 0]), 'T'), np.char.strip(text[:, 1]))
+        date_time = date_time.astype('datetime64[s]')
+    else:
+        raise ValueError(f"Unknown time_source {time_source!r}")
+
+    return PltTrack(columns[:, 0], columns[:, 1], columns[:, 2], date_time)
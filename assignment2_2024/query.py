@@ -1,34 +1,86 @@
-import math
-from DbConnector import DbConnector
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import io
+import sys
+import threading
+import time
+import numpy as np
+from activity_summary import max_gaps
+from DbConnector import MAX_POOL_SIZE, DbConnector
+from distance import DistanceAccumulator, haversine_km
+from grid import cell_ranges, radius_bbox
+from instrumentation import NO_INSTRUMENTS, Instruments
+from query_cache import DiskBackend, MemoryBackend, QueryCache
+from simplify import TRACKPOINT_TABLES
+import mysql.connector as mysql
+from streaming import stream_arrays
 from tabulate import tabulate
 
 class GeolifeAnalysisTask:
-    def __init__(self):
+    def __init__(self, use_summary=False, cache=None, instruments=None, tier='raw', **db_config):
+        # With use_summary, the TrackPoint-heavy questions are answered from the ActivitySummary
+        # table filled at ingest time instead of window functions and self-joins over TrackPoint
+        self.use_summary = use_summary
+        # tier 'simplified' reads TrackPointSimplified (see simplify.py) instead of TrackPoint: distance
+        # and altitude gain stay exact, positions are within the tolerance used at ingest
+        self.tier = tier
+        self.trackpoint_table = TRACKPOINT_TABLES[tier]
+        # Optional QueryCache; results are reused until the loader bumps the data version
+        self.cache = cache
+        # Timers for SQL execution and fetching, see instrumentation.py; disabled unless passed in
+        self.instruments = instruments or NO_INSTRUMENTS
         # Establishing the connection to the MySQL database using DbConnector
-        self.connection = DbConnector()
+        self.connection = DbConnector(**db_config)
         self.db_connection = self.connection.db_connection
         self.cursor = self.connection.cursor
+
+    def data_version(self):
+        # Stamp of the loaded data for QueryCache; None when the DataVersion table is missing or
+        # predates the token column (until the next load adds it), which turns caching off
+        try:
+            self.cursor.execute("SELECT version, token FROM DataVersion WHERE id = 1")
+            rows = self.cursor.fetchall()
+        except mysql.Error:
+            return None
+        config = self.connection.config
+        return (config['host'], config['port'], config['database']) + (rows[0] if rows else (0, None))
+
+    def cached(self, key_parts, compute):
+        if self.cache is None:
+            return compute()
+        return self.cache.get_or_compute(self.data_version(), key_parts, compute)
+
+    def fetchall(self, query, params=()):
+        def run():
+            with self.instruments.timer('sql_execute'):
+                self.cursor.execute(query, params)
+            with self.instruments.timer('sql_fetchall'):
+                rows = self.cursor.fetchall()
+            self.instruments.count('rows_fetched', len(rows))
+            return rows
+        return self.cached((query, params), run)
+
+    def fetchone(self, query, params=()):
+        rows = self.fetchall(query, params)
+        return rows[0] if rows else None
     
     def count_entries(self):
         # Count users
-        self.cursor.execute("SELECT COUNT(*) FROM User")
-        user_count = self.cursor.fetchone()[0]
+        user_count = self.fetchone("SELECT COUNT(*) FROM User")[0]
         
         # Count activities
-        self.cursor.execute("SELECT COUNT(*) FROM Activity")
-        activity_count = self.cursor.fetchone()[0]
+        activity_count = self.fetchone("SELECT COUNT(*) FROM Activity")[0]
         
         # Count trackpoints
-        self.cursor.execute("SELECT COUNT(*) FROM TrackPoint")
-        trackpoint_count = self.cursor.fetchone()[0]
+        trackpoint_count = self.fetchone(f"SELECT COUNT(*) FROM {self.trackpoint_table}")[0]
         
         print(f"Users: {user_count}, Activities: {activity_count}, TrackPoints: {trackpoint_count}")
         return user_count, activity_count, trackpoint_count
 
     def average_activities_per_user(self):
         query = "SELECT COUNT(*) / (SELECT COUNT(*) FROM User) FROM Activity"
-        self.cursor.execute(query)
-        avg_activities = self.cursor.fetchone()[0]
+        avg_activities = self.fetchone(query)[0]
         print(f"Average number of activities per user: {avg_activities}")
         return avg_activities
 
@@ -37,24 +89,25 @@ class GeolifeAnalysisTask:
         SELECT user_id, COUNT(*) as activity_count
         FROM Activity
         GROUP BY user_id
-        ORDER BY activity_count DESC
+        ORDER BY activity_count DESC, user_id
         LIMIT 20
         """
-        self.cursor.execute(query)
-        result = self.cursor.fetchall()
+        result = self.fetchall(query)
         print("Top 20 users with the highest number of activities:")
         print(tabulate(result, headers=['User ID', 'Activity Count'], tablefmt='grid'))
+        return result
 
     def users_taken_taxi(self):
         query = """
         SELECT DISTINCT user_id
         FROM Activity
         WHERE transportation_mode = 'taxi'
+        ORDER BY user_id
         """
-        self.cursor.execute(query)
-        users = self.cursor.fetchall()
+        users = self.fetchall(query)
         print("Users who have taken a taxi:")
         print(tabulate(users, headers=['User ID'], tablefmt='grid'))
+        return users
     
     def count_transportation_modes(self):
         query = """
@@ -62,23 +115,22 @@ class GeolifeAnalysisTask:
         FROM Activity
         WHERE transportation_mode IS NOT NULL
         GROUP BY transportation_mode
-        ORDER BY activity_count DESC
+        ORDER BY activity_count DESC, transportation_mode
         """
-        self.cursor.execute(query)
-        modes = self.cursor.fetchall()
+        modes = self.fetchall(query)
         print("Transportation modes and their activity counts:")
         print(tabulate(modes, headers=['Mode', 'Activity Count'], tablefmt='grid'))
+        return modes
 
     def year_with_most_activities(self):
         query = """
         SELECT YEAR(start_date_time) as year, COUNT(*) as activity_count
         FROM Activity
         GROUP BY year
-        ORDER BY activity_count DESC
+        ORDER BY activity_count DESC, year
         LIMIT 1
         """
-        self.cursor.execute(query)
-        result = self.cursor.fetchone()
+        result = self.fetchone(query)
         print(f"Year with the most activities: {result[0]} ({result[1]} activities)")
         return result
 
@@ -87,40 +139,101 @@ class GeolifeAnalysisTask:
         SELECT YEAR(start_date_time) as year, SUM(TIMESTAMPDIFF(HOUR, start_date_time, end_date_time)) as total_hours
         FROM Activity
         GROUP BY year
-        ORDER BY total_hours DESC
+        ORDER BY total_hours DESC, year
         LIMIT 1
         """
-        self.cursor.execute(query)
-        result = self.cursor.fetchone()
+        if self.use_summary:
+            # DIV 3600 truncates to whole hours per activity, like TIMESTAMPDIFF(HOUR, ...)
+            query = """
+            SELECT YEAR(A.start_date_time) as year, SUM(S.duration_seconds DIV 3600) as total_hours
+            FROM ActivitySummary S
+            JOIN Activity A ON S.activity_id = A.id
+            GROUP BY year
+            ORDER BY total_hours DESC, year
+            LIMIT 1
+            """
+        result = self.fetchone(query)
         print(f"Year with the most recorded hours: {result[0]} ({result[1]} hours)")
         return result
 
+    def stream_arrays(self, query, params=(), dtypes=(), chunk_size=50000):
+        # Yields the result in chunks of column arrays instead of materializing it with fetchall
+        chunks = stream_arrays(self.db_connection, query, params, dtypes, chunk_size)
+        if not self.instruments.enabled:
+            return chunks
+        return self.timed_chunks(chunks)
+
+    def timed_chunks(self, chunks):
+        # Times the fetch of every chunk, not the caller's work between chunks
+        try:
+            while True:
+                with self.instruments.timer('sql_stream_chunk'):
+                    columns = next(chunks, None)
+                if columns is None:
+                    return
+                self.instruments.count('rows_streamed', len(columns[0]))
+                yield columns
+        finally:
+            chunks.close()  # Consumes the rest of the result if the caller stopped early
+
     def haversine(self, lat1, lon1, lat2, lon2):
-        # Earth radius in kilometers
-        R = 6371  
-        d_lat = math.radians(lat2 - lat1)
-        d_lon = math.radians(lon2 - lon1)
-        a = math.sin(d_lat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(d_lon / 2) ** 2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-        return R * c  # Distance in kilometers
-
-    def total_distance_walked_2008(self, user_id='112'):
-        query = """
-        SELECT T.latitude, T.longitude
-        FROM TrackPoint T
-        JOIN Activity A ON T.activity_id = A.id
-        WHERE A.user_id = %s AND A.transportation_mode = 'walk' AND YEAR(A.start_date_time) = 2008
-        ORDER BY T.date_time
+        # Works on scalars and on NumPy arrays of coordinates, distance in kilometers
+        return haversine_km(lat1, lon1, lat2, lon2)
+
+    def distance_totals(self, where="TRUE", params=(), chunk_size=50000):
+        """
+        Distance in km per activity, per user and per transportation mode for the activities
+        matching `where` (a condition on Activity A), computed in one streamed pass over TrackPoint.
+        Distances are only summed between consecutive points of the same activity.
         """
-        self.cursor.execute(query, (user_id,))
-        trackpoints = self.cursor.fetchall()
+        return self.cached(('distance_totals', self.tier, where, params),
+                           lambda: self.compute_distance_totals(where, params, chunk_size))
+
+    def compute_distance_totals(self, where, params, chunk_size):
+        activities = {activity_id: (user_id, mode) for activity_id, user_id, mode
+                      in self.fetchall(f"SELECT A.id, A.user_id, A.transportation_mode FROM Activity A WHERE {where}", params)}
+
+        accumulator = DistanceAccumulator()
+        if self.tier == 'simplified':
+            # The kept points carry the raw distance from the previous kept point
+            query = f"""
+            SELECT T.activity_id, SUM(T.segment_distance_km)
+            FROM TrackPointSimplified T
+            JOIN Activity A ON T.activity_id = A.id
+            WHERE {where}
+            GROUP BY T.activity_id
+            """
+            accumulator.totals.update((activity_id, float(total)) for activity_id, total in self.fetchall(query, params))
+        else:
+            query = f"""
+            SELECT T.activity_id, T.latitude, T.longitude
+            FROM TrackPoint T
+            JOIN Activity A ON T.activity_id = A.id
+            WHERE {where}
+            ORDER BY T.activity_id, T.date_time
+            """
+            for activity_ids, latitudes, longitudes in self.stream_arrays(query, params, (np.int64, float, float), chunk_size):
+                accumulator.add(activity_ids, latitudes, longitudes)
+
+        per_activity = dict(accumulator.totals)
+        per_user = accumulator.group_totals({activity_id: key[0] for activity_id, key in activities.items()})
+        per_mode = accumulator.group_totals({activity_id: key[1] for activity_id, key in activities.items()})
+        return per_activity, per_user, per_mode
+
+    def total_distance_walked_2008(self, user_id='112', chunk_size=50000):
+        # A range on start_date_time instead of YEAR() so idx_activity_user_start can be used
+        where = "A.user_id = %s AND A.transportation_mode = 'walk' AND A.start_date_time >= '2008-01-01' AND A.start_date_time < '2009-01-01'"
+        if self.use_summary:
+            total_distance = float(self.fetchone(f"""
+            SELECT COALESCE(SUM(S.distance_km), 0)
+            FROM ActivitySummary S
+            JOIN Activity A ON S.activity_id = A.id
+            WHERE {where}
+            """, (user_id,))[0])
+        else:
+            per_activity, _, _ = self.distance_totals(where, (user_id,), chunk_size)
+            total_distance = sum(per_activity.values())
 
-        total_distance = 0.0
-        for i in range(1, len(trackpoints)):
-            lat1, lon1 = trackpoints[i - 1]
-            lat2, lon2 = trackpoints[i]
-            total_distance += self.haversine(lat1, lon1, lat2, lon2)
-        
         print(f"Total distance walked by user {user_id} in 2008: {total_distance:.2f} km")
         return total_distance
 
@@ -137,40 +250,120 @@ class GeolifeAnalysisTask:
                 WHERE T1.altitude > -777  -- Exclude invalid altitude
             ) AS altitude_diffs
             GROUP BY user_id
-            ORDER BY total_altitude_gain DESC
+            ORDER BY total_altitude_gain DESC, user_id
             LIMIT 20;
         
         """
-        self.cursor.execute(query)
-        result = self.cursor.fetchall()
+        if self.tier == 'simplified':
+            query = """
+            SELECT A.user_id, SUM(T.segment_altitude_gain) AS total_altitude_gain
+            FROM TrackPointSimplified T
+            JOIN Activity A ON T.activity_id = A.id
+            GROUP BY A.user_id
+            ORDER BY total_altitude_gain DESC, A.user_id
+            LIMIT 20
+            """
+        if self.use_summary:
+            query = """
+            SELECT A.user_id, SUM(S.altitude_gain) AS total_altitude_gain
+            FROM ActivitySummary S
+            JOIN Activity A ON S.activity_id = A.id
+            GROUP BY A.user_id
+            ORDER BY total_altitude_gain DESC, A.user_id
+            LIMIT 20
+            """
+        result = self.fetchall(query)
         print("Top 20 users with the highest altitude gain:")
         print(tabulate(result, headers=['User ID', 'Total Gain (meters)'], tablefmt='grid'))
+        return result
 
-    def find_invalid_activities(self):
-        query = """
-        SELECT A.user_id, COUNT(A.id) as invalid_activities
-        FROM Activity A
-        JOIN TrackPoint T1 ON A.id = T1.activity_id
-        JOIN TrackPoint T2 ON T1.id = T2.id + 1
-        WHERE TIMESTAMPDIFF(MINUTE, T1.date_time, T2.date_time) > 5
-        GROUP BY A.user_id;
-        """
-        self.cursor.execute(query)
-        result = self.cursor.fetchall()
+    def activity_max_gaps(self, chunk_size=50000):
+        """
+        {activity_id: largest time gap in seconds between consecutive trackpoints}, computed in one
+        streamed pass over the trackpoints in activity order (see activity_summary.max_gaps). The
+        result is cached, so other thresholds do not rescan TrackPoint.
+        """
+        query = f"SELECT activity_id, date_time FROM {self.trackpoint_table} ORDER BY activity_id, date_time"
+        return self.cached(('activity_max_gaps', self.tier),
+                           lambda: max_gaps(self.stream_arrays(query, (), (np.int64, 'datetime64[s]'), chunk_size)))
+
+    def find_invalid_activities(self, gap_minutes=5):
+        """
+        Users with their number of invalid activities: activities with two consecutive trackpoints
+        gap_minutes or more apart. With use_summary the per-activity gaps stored in ActivitySummary
+        at ingest are used. Simplification never creates or hides a gap of 5 minutes or more, so
+        both tiers agree for gap_minutes >= 5.
+        """
+        threshold = gap_minutes * 60
+        if self.use_summary:
+            query = """
+            SELECT A.user_id, COUNT(*) as invalid_activities
+            FROM ActivitySummary S
+            JOIN Activity A ON S.activity_id = A.id
+            WHERE S.max_gap_seconds >= %s
+            GROUP BY A.user_id
+            ORDER BY A.user_id
+            """
+            result = self.fetchall(query, (threshold,))
+        else:
+            users = dict(self.fetchall("SELECT id, user_id FROM Activity"))
+            counts = Counter(users[activity_id] for activity_id, gap in self.activity_max_gaps().items() if gap >= threshold)
+            result = sorted(counts.items())
         print("Users with invalid activities:")
         print(tabulate(result, headers=['User ID', 'Invalid Activities'], tablefmt='grid'))
+        return result
 
-    def find_users_in_forbidden_city(self):
-        query = """
+    def grid_condition(self, min_lat, min_lon, max_lat, max_lon):
+        # SQL condition and parameters selecting the TrackPoint grid cells that overlap the box
+        ranges = cell_ranges(min_lat, min_lon, max_lat, max_lon)
+        condition = " OR ".join(["T.grid_cell BETWEEN %s AND %s"] * len(ranges))
+        return f"({condition})", tuple(cell for cell_range in ranges for cell in cell_range)
+
+    def users_in_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        """
+        Users with a trackpoint inside the box. The indexed grid_cell column narrows the search to the
+        cells overlapping the box; the exact coordinate test only runs on the trackpoints in those cells.
+        """
+        condition, params = self.grid_condition(min_lat, min_lon, max_lat, max_lon)
+        query = f"""
         SELECT DISTINCT A.user_id
-        FROM TrackPoint T
+        FROM {self.trackpoint_table} T
         JOIN Activity A ON T.activity_id = A.id
-        WHERE ABS(T.latitude - 39.916) < 0.005 AND ABS(T.longitude - 116.397) < 0.005;
+        WHERE {condition}
+          AND T.latitude BETWEEN %s AND %s AND T.longitude BETWEEN %s AND %s
+        ORDER BY A.user_id
+        """
+        return [row[0] for row in self.fetchall(query, params + (min_lat, max_lat, min_lon, max_lon))]
+
+    def users_within(self, lat, lon, radius_m, chunk_size=50000):
         """
-        self.cursor.execute(query)
-        result = self.cursor.fetchall()
+        Users with a trackpoint at most radius_m meters from (lat, lon). Candidates come from the
+        grid cells covering the circle's bounding box and are filtered by haversine distance.
+        """
+        def compute():
+            min_lat, min_lon, max_lat, max_lon = radius_bbox(lat, lon, radius_m)
+            condition, params = self.grid_condition(min_lat, min_lon, max_lat, max_lon)
+            query = f"""
+            SELECT A.user_id, T.latitude, T.longitude
+            FROM {self.trackpoint_table} T
+            JOIN Activity A ON T.activity_id = A.id
+            WHERE {condition}
+              AND T.latitude BETWEEN %s AND %s AND T.longitude BETWEEN %s AND %s
+            """
+            users = set()
+            for user_ids, latitudes, longitudes in self.stream_arrays(
+                    query, params + (min_lat, max_lat, min_lon, max_lon), (str, float, float), chunk_size):
+                inside = haversine_km(lat, lon, latitudes, longitudes) * 1000 <= radius_m
+                users.update(user_ids[inside].tolist())
+            return sorted(users)
+        return self.cached(('users_within', self.tier, lat, lon, radius_m), compute)
+
+    def find_users_in_forbidden_city(self):
+        # The box of +-0.005 degrees around (39.916, 116.397)
+        result = [(user_id,) for user_id in self.users_in_bbox(39.916 - 0.005, 116.397 - 0.005, 39.916 + 0.005, 116.397 + 0.005)]
         print("Users who have tracked an activity in the Forbidden City:")
         print(tabulate(result, headers=['User ID'], tablefmt='grid'))
+        return result
 
     def find_most_used_transport_mode(self):
         query = """
@@ -178,10 +371,9 @@ class GeolifeAnalysisTask:
         FROM Activity
         WHERE transportation_mode IS NOT NULL
         GROUP BY user_id, transportation_mode
-        ORDER BY user_id, mode_count DESC;
+        ORDER BY user_id, mode_count DESC, transportation_mode;
         """
-        self.cursor.execute(query)
-        result = self.cursor.fetchall()
+        result = self.fetchall(query)
         user_modes = {}
         
         for row in result:
@@ -191,28 +383,152 @@ class GeolifeAnalysisTask:
         formatted_result = [(user, mode) for user, mode in user_modes.items()]
         print("Users and their most used transportation mode:")
         print(tabulate(formatted_result, headers=['User ID', 'Most Used Mode'], tablefmt='grid'))
-        
+        return formatted_result
+
     def close_connection(self):
         self.connection.close_connection()
 
+# The Part 2 questions, in the order main() answers them
+ANALYSES = [
+    'count_entries',
+    'average_activities_per_user',
+    'top_20_users',
+    'users_taken_taxi',
+    'count_transportation_modes',
+    'year_with_most_activities',
+    'year_with_most_recorded_hours',
+    'total_distance_walked_2008',
+    'top_20_altitude_gains',
+    'find_invalid_activities',
+    'find_users_in_forbidden_city',
+    'find_most_used_transport_mode',
+]
+
+class ThreadLocalOutput:
+    """sys.stdout stand-in that sends the prints of a thread with a buffer set to that buffer."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+
+    def write(self, text):
+        return getattr(self.local, 'buffer', self.stream).write(text)
+
+    def flush(self):
+        getattr(self.local, 'buffer', self.stream).flush()
+
+
+def run_analyses(task_factory, names=ANALYSES, workers=1, instruments=NO_INSTRUMENTS):
+    """
+    Runs the named analyses and returns their results and latencies (seconds) in the order of names.
+
+    With workers > 1 they run on a pool of threads, each with its own task from task_factory (for
+    GeolifeAnalysisTask, its own pooled connection), so the wall time approaches that of the slowest
+    query instead of the sum. Every analysis prints into a buffer of its own; the buffers are
+    printed in the original order once all are done, so the output is the same as a serial run.
+    """
+    def run(task, name):
+        start = time.perf_counter()
+        with instruments.timer(f"query.{name}"):
+            result = getattr(task, name)()
+        return result, time.perf_counter() - start
+
+    if workers <= 1:
+        task = task_factory()
+        try:
+            outcomes = [run(task, name) for name in names]
+        finally:
+            task.close_connection()
+        return [result for result, _ in outcomes], [seconds for _, seconds in outcomes]
+
+    local = threading.local()
+    tasks = []
+    tasks_lock = threading.Lock()
+    output = ThreadLocalOutput(sys.stdout)
+
+    def job(name):
+        if not hasattr(local, 'task'):
+            local.task = task_factory()
+            with tasks_lock:
+                tasks.append(local.task)
+        output.local.buffer = io.StringIO()
+        try:
+            result, seconds = run(local.task, name)
+            return result, seconds, output.local.buffer.getvalue()
+        finally:
+            del output.local.buffer
+
+    sys.stdout = output
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            outcomes = [future.result() for future in [executor.submit(job, name) for name in names]]
+    finally:
+        sys.stdout = output.stream
+        for task in tasks:
+            task.close_connection()
+    for _, _, text in outcomes:
+        print(text, end='')
+    return [result for result, _, _ in outcomes], [seconds for _, seconds, _ in outcomes]
+
+
 def main():
-    task = GeolifeAnalysisTask()
+    parser = argparse.ArgumentParser(description="Answer the Part 2 questions")
+    parser.add_argument('--use-summary', action='store_true',
+                        help="answer the TrackPoint-heavy questions from the ActivitySummary table")
+    parser.add_argument('--cache', choices=['none', 'memory', 'disk'], default='none',
+                        help="reuse results until the data changes; disk keeps them between runs")
+    parser.add_argument('--cache-dir', default='.query_cache')
+    parser.add_argument('--backend', choices=['mysql', 'parquet'], default='mysql',
+                        help="parquet answers from the files written by parquet_backend.py export, without MySQL")
+    parser.add_argument('--parquet-dir', default='parquet')
+    parser.add_argument('--tier', choices=sorted(TRACKPOINT_TABLES), default='raw',
+                        help="simplified reads the TrackPointSimplified table loaded with GeoLifeTask.py --simplify")
+    parser.add_argument('--instrument', action='store_true', help="time every query and print a report at the end")
+    parser.add_argument('--profile', action='store_true', help="also run cProfile over the queries (implies --instrument)")
+    parser.add_argument('--trace-memory', action='store_true',
+                        help="also record the peak memory with tracemalloc (implies --instrument)")
+    parser.add_argument('--metrics-output', help="write the timers, counters and profile to this JSON file")
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help="run the questions on this many threads, each with its own pooled connection")
+    args = parser.parse_args()
+    if not 1 <= args.concurrency <= MAX_POOL_SIZE:
+        parser.error(f"--concurrency must be between 1 and {MAX_POOL_SIZE}, the largest connection pool")
+    instruments = Instruments(enabled=args.instrument or args.profile or args.trace_memory or bool(args.metrics_output),
+                              profile=args.profile, trace_memory=args.trace_memory)
+
+    cache = None
+    if args.cache == 'memory':
+        cache = QueryCache(MemoryBackend())
+    elif args.cache == 'disk':
+        cache = QueryCache(DiskBackend(args.cache_dir))
+
+    if args.backend == 'parquet':
+        # Imported here so the MySQL backend does not need pyarrow
+        from parquet_backend import ParquetAnalysisTask
+        # Read-only, so every thread can share one
+        parquet_task = ParquetAnalysisTask(args.parquet_dir)
+        task_factory = lambda: parquet_task
+    else:
+        # With concurrency, each thread's task borrows a connection from one shared pool
+        pool_size = args.concurrency if args.concurrency > 1 else None
+        task_factory = lambda: GeolifeAnalysisTask(use_summary=args.use_summary, cache=cache, instruments=instruments,
+                                                   tier=args.tier, POOL_SIZE=pool_size, VERBOSE=pool_size is None)
     # Run the required methods for Part 2 questions
-    task.count_entries()
-    task.average_activities_per_user()
-    task.top_20_users()
-    task.users_taken_taxi()
-    task.count_transportation_modes()
-    task.year_with_most_activities()
-    task.year_with_most_recorded_hours()
-    task.total_distance_walked_2008()
-    task.top_20_altitude_gains()
-    task.find_invalid_activities()
-    task.find_users_in_forbidden_city()
-    task.find_most_used_transport_mode()
-
-    # Close connection
-    task.close_connection()
+    started = time.perf_counter()
+    with instruments.capture():
+        _, latencies = run_analyses(task_factory, ANALYSES, args.concurrency, instruments)
+    wall = time.perf_counter() - started
+
+    rows = list(zip(ANALYSES, latencies)) + [('sum of latencies', sum(latencies)), ('total (wall)', wall)]
+    print(tabulate(rows, headers=['Query', 'Seconds'], tablefmt='grid', floatfmt='.3f'))
+
+    if cache:
+        print(f"Query cache: {cache.hits} hits, {cache.misses} misses")
+        instruments.count('cache_hits', cache.hits)
+        instruments.count('cache_misses', cache.misses)
+    instruments.report()
+    if args.metrics_output:
+        instruments.dump(args.metrics_output)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,114 @@
+from collections import OrderedDict
+import hashlib
+import os
+import pickle
+import threading
+
+data_version_table = """CREATE TABLE IF NOT EXISTS %s (
+                               id TINYINT NOT NULL PRIMARY KEY,
+                               version BIGINT NOT NULL,
+                               token CHAR(32),
+                               updated_at DATETIME)"""
+
+MISSING = object()
+
+
+class MemoryBackend:
+    """In-memory LRU store; least recently used entries are evicted once max_bytes (pickled size) is exceeded."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        if key not in self.entries:
+            return MISSING
+        self.entries.move_to_end(key)
+        return pickle.loads(self.entries[key])
+
+    def set(self, key, value):
+        data = pickle.dumps(value)
+        if len(data) > self.max_bytes:
+            return
+        if key in self.entries:
+            self.size -= len(self.entries.pop(key))
+        self.entries[key] = data
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+
+class DiskBackend:
+    """One pickle file per entry in directory; survives restarts, so reports rerun without touching MySQL."""
+
+    def __init__(self, directory='.query_cache'):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def get(self, key):
+        try:
+            with open(self.path(key), 'rb') as file:
+                return pickle.load(file)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return MISSING
+
+    def set(self, key, value):
+        # Written to a temporary name first so a concurrent reader never sees half a file
+        temporary_path = self.path(key) + f'.{os.getpid()}.tmp'
+        with open(temporary_path, 'wb') as file:
+            pickle.dump(value, file)
+        os.replace(temporary_path, self.path(key))
+
+    def clear(self):
+        for filename in os.listdir(self.directory):
+            if filename.endswith('.pkl'):
+                os.remove(os.path.join(self.directory, filename))
+
+
+class QueryCache:
+    """
+    Caches query results keyed by the query text, its parameters and the data version. The loader
+    bumps the version in the DataVersion table after every load, so results computed before a
+    load are never returned after it. Without a version (no DataVersion table) nothing is cached.
+
+    The version passed in is a stamp of the server, the database, the version counter and the
+    random token the loader writes with every bump: the counter alone restarts at 1 whenever
+    DataVersion is recreated, and says nothing about which database the results came from.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        # Concurrent queries share the cache; compute() itself runs outside the lock
+        self.lock = threading.Lock()
+
+    def key(self, version, key_parts):
+        return hashlib.sha256(repr((version,) + tuple(key_parts)).encode()).hexdigest()
+
+    def get_or_compute(self, version, key_parts, compute):
+        if version is None:
+            return compute()
+        key = self.key(version, key_parts)
+        with self.lock:
+            value = self.backend.get(key)
+            if value is not MISSING:
+                self.hits += 1
+                return value
+            self.misses += 1
+        value = compute()
+        with self.lock:
+            self.backend.set(key, value)
+        return value
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,121 @@
+"""
+Douglas-Peucker simplification of activities for the TrackPointSimplified tier.
+
+A point is dropped when it lies within `tolerance_m` meters of the line between the points kept
+around it and the time between those points is less than `max_gap_seconds`. The time rule means
+the simplified tier has exactly the raw track's gaps of max_gap_seconds or more, so
+find_invalid_activities gives the same answer on both tiers for thresholds of at least that.
+
+Error bounds of the simplified tier:
+- every raw point is within tolerance_m of the simplified line (positions, geo-fence queries);
+- distance and altitude gain are exact: each kept point stores the raw distance and raw altitude
+  gain since the previous kept point (segment_distance_km, segment_altitude_gain), so summing them
+  gives the same totals as the raw tier, up to floating point rounding.
+"""
+import numpy as np
+from activity_summary import INVALID_ALTITUDE
+from distance import haversine_km
+
+# Tier name -> table, for the analyses that can read either
+TRACKPOINT_TABLES = {'raw': 'TrackPoint', 'simplified': 'TrackPointSimplified'}
+
+METERS_PER_DEGREE = 111320
+
+SIMPLIFIED_COLUMNS = ('activity_id', 'latitude', 'longitude', 'altitude', 'date_time', 'grid_cell',
+                      'segment_distance_km', 'segment_altitude_gain')
+
+simplified_trackpoint_table = """CREATE TABLE IF NOT EXISTS %s (
+                                 id INT AUTO_INCREMENT PRIMARY KEY,
+                                 activity_id INT,
+                                 latitude DOUBLE,
+                                 longitude DOUBLE,
+                                 altitude INT,
+                                 date_time DATETIME,
+                                 grid_cell INT,
+                                 segment_distance_km DOUBLE,
+                                 segment_altitude_gain INT,
+                                 FOREIGN KEY (activity_id) REFERENCES Activity(id) ON DELETE CASCADE)"""
+
+
+def simplify_mask(latitudes, longitudes, seconds, tolerance_m, max_gap_seconds=None):
+    """
+    Boolean mask of the points Douglas-Peucker keeps. Instead of recursing per segment, every pass
+    scores all points against the chord of the segment they are in and splits every segment whose
+    worst point is out of tolerance, so each pass is a handful of NumPy operations over the track.
+    """
+    n = len(latitudes)
+    if n < 3:
+        return np.ones(n, dtype=bool)
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+
+    # Local equirectangular projection to meters, accurate enough over one activity
+    y = latitudes * METERS_PER_DEGREE
+    x = longitudes * METERS_PER_DEGREE * np.cos(np.radians(np.mean(latitudes)))
+    seconds = seconds.astype(np.float64)
+    indices = np.arange(n)
+
+    while True:
+        kept = np.flatnonzero(keep)
+        segment = np.minimum(np.searchsorted(kept, indices, side='right') - 1, len(kept) - 2)
+        start, end = kept[segment], kept[segment + 1]
+        interior = (indices > start) & (indices < end)
+
+        # Distance to the chord as a multiple of the tolerance, > 1 means the point must stay
+        dx, dy = x[end] - x[start], y[end] - y[start]
+        length2 = dx * dx + dy * dy
+        along = np.clip(np.divide((x - x[start]) * dx + (y - y[start]) * dy, length2,
+                                  out=np.zeros(n), where=length2 > 0), 0, 1)
+        score = np.hypot(x - x[start] - along * dx, y - y[start] - along * dy) / tolerance_m
+
+        if max_gap_seconds is not None:
+            # Segments spanning too long a time are split, at the point closest to their middle
+            span = seconds[end] - seconds[start]
+            balance = np.minimum(seconds - seconds[start], seconds[end] - seconds) / np.maximum(span, 1)
+            score = np.maximum(score, np.where(span >= max_gap_seconds, 1 + balance, 0))
+
+        score = np.where(interior, score, 0)
+        worst = np.zeros(len(kept) - 1)
+        np.maximum.at(worst, segment, score)
+        split = interior & (score > 1) & (score == worst[segment])
+        if not split.any():
+            return keep
+        # One point per segment: the first of its worst points
+        _, first = np.unique(segment[split], return_index=True)
+        keep[np.flatnonzero(split)[first]] = True
+
+
+def segment_aggregates(track, keep):
+    """
+    Raw distance (km) and altitude gain from the previous kept point to every kept point, 0 for
+    the first. The gain counts rises between consecutive valid altitudes like summarize does.
+    """
+    steps = np.zeros(track.size)
+    steps[1:] = haversine_km(track.latitude[:-1], track.longitude[:-1], track.latitude[1:], track.longitude[1:])
+    altitudes = np.trunc(track.altitude).astype(np.int64)
+    valid = np.flatnonzero(altitudes > INVALID_ALTITUDE)
+    rises = np.zeros(track.size, dtype=np.int64)
+    rises[valid[1:]] = np.maximum(np.diff(altitudes[valid]), 0)
+
+    kept = np.flatnonzero(keep)
+    distances = np.diff(np.cumsum(steps)[kept], prepend=0.0)
+    gains = np.diff(np.cumsum(rises)[kept], prepend=0)
+    return distances, gains
+
+
+class TrackSimplifier:
+    """Simplifies PltTracks for the TrackPointSimplified tier with the bounds described above."""
+
+    def __init__(self, tolerance_m=10.0, max_gap_seconds=300):
+        self.tolerance_m = tolerance_m
+        self.max_gap_seconds = max_gap_seconds
+
+    def mask(self, track):
+        seconds = track.date_time.astype('datetime64[s]').astype(np.int64)
+        return simplify_mask(track.latitude, track.longitude, seconds, self.tolerance_m, self.max_gap_seconds)
+
+    def simplify(self, track):
+        # Returns the simplified PltTrack and its segment_distance_km and segment_altitude_gain columns
+        keep = self.mask(track)
+        distances, gains = segment_aggregates(track, keep)
+        return type(track)(*(column[keep] for column in track)), distances, gains
@@ -0,0 +1,25 @@
+import numpy as np
+
+
+def stream_arrays(db_connection, query, params=(), dtypes=(), chunk_size=50000):
+    """
+    Runs query on an unbuffered cursor and yields the result in chunks of at most chunk_size rows,
+    each chunk a list with one NumPy array per column (dtypes gives the column types, e.g. float
+    or 'datetime64[s]'; columns past the end of dtypes get the type NumPy infers). Rows are pulled from the server as the chunks are consumed, so memory
+    use depends on chunk_size and not on the size of the result.
+    """
+    cursor = db_connection.cursor(buffered=False)
+    try:
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            columns = list(zip(*rows))
+            column_dtypes = tuple(dtypes) + (None,) * (len(columns) - len(dtypes))
+            yield [np.asarray(column, dtype=dtype) for column, dtype in zip(columns, column_dtypes)]
+    finally:
+        # If the consumer stopped early, the rest of the result must be read before the
+        # connection can run another statement
+        db_connection.consume_results()
+        cursor.close()
@@ -0,0 +1,89 @@
+"""
+Generates a synthetic dataset in the Geolife layout, for benchmarking without the real data:
+
+    <root>/labeled_ids.txt
+    <root>/Data/<user>/labels.txt            (labeled users only)
+    <root>/Data/<user>/Trajectory/<start>.plt
+
+    python3 synthetic.py --root synthetic --users 20 --files-per-user 50 --points-per-file 1000
+"""
+from datetime import datetime, timedelta
+import argparse
+import os
+import numpy as np
+
+MODES = ['walk', 'bike', 'bus', 'car', 'taxi', 'subway', 'train']
+PLT_HEADER = "Geolife trajectory\nWGS 84\nAltitude is in Feet\nReserved 3\n0,2,255,My Track,0,0,2,8421376\n0\n"
+OLE_EPOCH = datetime(1899, 12, 30)
+
+
+def write_plt(path, start_time, points, random):
+    # A random walk around Beijing, 1-5 seconds between fixes with an occasional gap of 5-15 minutes
+    steps = random.integers(1, 6, points)
+    steps[random.random(points) < 0.002] = random.integers(300, 900)
+    steps[0] = 0
+    seconds = np.cumsum(steps)
+    latitudes = 39.9 + np.cumsum(random.normal(0, 1e-4, points)) + random.normal(0, 0.05)
+    longitudes = 116.4 + np.cumsum(random.normal(0, 1e-4, points)) + random.normal(0, 0.05)
+    altitudes = np.round(150 + np.cumsum(random.normal(0, 2, points)))
+    days = (start_time - OLE_EPOCH).total_seconds() / 86400 + seconds / 86400
+
+    with open(path, 'w') as file:
+        file.write(PLT_HEADER)
+        for lat, lon, alt, day, second in zip(latitudes, longitudes, altitudes, days, seconds.tolist()):
+            time = start_time + timedelta(seconds=second)
+            file.write(f"{lat:.6f},{lon:.6f},0,{alt:.0f},{day:.10f},{time:%Y-%m-%d},{time:%H:%M:%S}\n")
+    return start_time + timedelta(seconds=int(seconds[-1]))
+
+
+def generate_dataset(root, users=10, files_per_user=20, points_per_file=500, label_density=0.5,
+                     labeled_user_share=0.5, seed=0):
+    """
+    Writes the dataset and returns the number of .plt files. label_density is the share of a
+    labeled user's files that get a label with their exact start and end time.
+    """
+    random = np.random.default_rng(seed)
+    labeled_users = []
+    for user in range(users):
+        user_id = f"{user:03d}"
+        trajectory_folder = os.path.join(root, 'Data', user_id, 'Trajectory')
+        os.makedirs(trajectory_folder, exist_ok=True)
+        labeled = random.random() < labeled_user_share
+        labels = []
+        start_time = datetime(2007, 4, 1) + timedelta(days=int(random.integers(0, 1500)))
+        for _ in range(files_per_user):
+            path = os.path.join(trajectory_folder, f"{start_time:%Y%m%d%H%M%S}.plt")
+            end_time = write_plt(path, start_time, points_per_file, random)
+            if labeled and random.random() < label_density:
+                labels.append((start_time, end_time, MODES[int(random.integers(len(MODES)))]))
+            start_time = end_time + timedelta(hours=int(random.integers(1, 72)))
+
+        if labeled:
+            labeled_users.append(user_id)
+            with open(os.path.join(root, 'Data', user_id, 'labels.txt'), 'w') as file:
+                file.write("Start Time\tEnd Time\tTransportation Mode\n")
+                for start, end, mode in labels:
+                    file.write(f"{start:%Y/%m/%d %H:%M:%S}\t{end:%Y/%m/%d %H:%M:%S}\t{mode}\n")
+
+    with open(os.path.join(root, 'labeled_ids.txt'), 'w') as file:
+        file.write(''.join(f"{user_id}\n" for user_id in labeled_users))
+    return users * files_per_user
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic Geolife dataset")
+    parser.add_argument('--root', default="synthetic")
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--files-per-user', type=int, default=20)
+    parser.add_argument('--points-per-file', type=int, default=500)
+    parser.add_argument('--label-density', type=float, default=0.5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    files = generate_dataset(args.root, args.users, args.files_per_user, args.points_per_file,
+                             args.label_density, seed=args.seed)
+    print(f"Wrote {files} .plt files to {os.path.join(args.root, 'Data')}")
+
+
+if __name__ == '__main__':
+    main()
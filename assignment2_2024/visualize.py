@@ -1,38 +1,296 @@
-import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
+"""
+Plots of the Geolife trackpoints.
+
+    python3 visualize.py scatter --users 128
+    python3 visualize.py heatmap --output heatmaps --tile-size 256 --workers 8
+    python3 visualize.py heatmap --source db --users 010 128 --modes walk bike --start 2008-01-01 --end 2009-01-01
+
+scatter draws every point of a few users with matplotlib. heatmap rasterizes any number of points
+into a fixed width x height grid of point counts and mean altitudes, and writes density.png and
+altitude.png (or tiles of them) without a display. Points are binned in batches, so memory depends
+on the grid size and not on the number of points.
+"""
+from datetime import datetime
+from multiprocessing import Pool
+import argparse
 import os
+import time
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-
-user_id = '128'  # Change to the desired user ID
-user_data_path = f"dataset/Data/{user_id}/Trajectory"
-
-def load_plt_data(path):
-    data = []
-    for filename in os.listdir(path):
-        if filename.endswith('.plt'):
-            file_path = os.path.join(path, filename)
-            with open(file_path, 'r') as f:
-                # Skip the first 6 lines
-                for _ in range(6):
-                    f.readline()
-                for line in f:
-                    parts = line.strip().split(',')
-                    lat = float(parts[0])  # Latitude
-                    lon = float(parts[1])  # Longitude
-                    alt = float(parts[3])  # Altitude
-                    data.append([lon, lat, alt])
-    return pd.DataFrame(data, columns=['lon', 'lat', 'alt'])
-
-# Load the data for the specified user
-df = load_plt_data(user_data_path)
-
-plt.figure(figsize=(10, 8))
-scatter = plt.scatter(df['lon'], df['lat'], c=df['alt'], cmap='viridis', s=1)
-plt.colorbar(scatter, label='Altitude (meters)')
-plt.xlabel('Longitude')
-plt.ylabel('Latitude')
-plt.title('Geolife Dataset: Latitude vs. Longitude Colored by Altitude')
-plt.show()
+from matplotlib import colormaps
+from matplotlib.image import imsave
+from activity_summary import INVALID_ALTITUDE
+from GeoLifeTask import iter_plt_files, parse_labels
+from label_index import LabelIndex
+from plt_parser import read_plt, time_bounds
+from simplify import TRACKPOINT_TABLES, TrackSimplifier
+
+# (min_lat, min_lon, max_lat, max_lon) around Beijing, where most of the dataset is
+BEIJING_BOUNDS = (39.70, 116.10, 40.15, 116.75)
+
+
+def iter_tracks(path, simplifier=None):
+    # Parses the files one at a time as os.scandir finds them; with a simplifier, each track is
+    # reduced to the points the simplified tier would store before the next file is read
+    with os.scandir(path) as entries:
+        for entry in entries:
+            if entry.name.endswith('.plt') and entry.is_file():
+                track = read_plt(entry.path)
+                yield simplifier.simplify(track)[0] if simplifier else track
+
+
+def load_plt_data(path, simplifier=None):
+    # Only the plotted columns of each track are kept, and copied once into the DataFrame
+    columns = {'lon': [], 'lat': [], 'alt': []}
+    for track in iter_tracks(path, simplifier):
+        columns['lon'].append(track.longitude)
+        columns['lat'].append(track.latitude)
+        columns['alt'].append(track.altitude)
+    return pd.DataFrame({name: np.concatenate(parts) if parts else np.empty(0) for name, parts in columns.items()})
+
+
+class Heatmap:
+    """
+    Point counts and altitude sums on a width x height raster over bounds, row 0 at the north edge.
+    add() only converts points to cell numbers; they are counted with np.bincount once flush_points
+    have piled up, so small chunks do not each pay for a pass over the whole grid.
+    """
+
+    def __init__(self, bounds=BEIJING_BOUNDS, width=1024, height=1024, flush_points=2000000):
+        self.bounds = bounds
+        self.width = width
+        self.height = height
+        self.flush_points = flush_points
+        self.counts = np.zeros(width * height, dtype=np.int64)
+        self.altitude_sums = np.zeros(width * height)
+        self.altitude_counts = np.zeros(width * height, dtype=np.int64)
+        self.pending = []
+        self.pending_points = 0
+
+    def add(self, latitudes, longitudes, altitudes):
+        min_lat, min_lon, max_lat, max_lon = self.bounds
+        columns = np.floor((longitudes - min_lon) * (self.width / (max_lon - min_lon))).astype(np.int64)
+        rows = np.floor((max_lat - latitudes) * (self.height / (max_lat - min_lat))).astype(np.int64)
+        inside = (columns >= 0) & (columns < self.width) & (rows >= 0) & (rows < self.height)
+        self.pending.append((rows[inside] * self.width + columns[inside], altitudes[inside]))
+        self.pending_points += int(inside.sum())
+        if self.pending_points >= self.flush_points:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        cells = np.concatenate([cells for cells, _ in self.pending])
+        altitudes = np.concatenate([altitudes for _, altitudes in self.pending])
+        self.pending, self.pending_points = [], 0
+        size = self.width * self.height
+        self.counts += np.bincount(cells, minlength=size)
+        valid = altitudes > INVALID_ALTITUDE
+        self.altitude_sums += np.bincount(cells[valid], weights=altitudes[valid], minlength=size)
+        self.altitude_counts += np.bincount(cells[valid], minlength=size)
+
+    def merge(self, other):
+        other.flush()
+        self.counts += other.counts
+        self.altitude_sums += other.altitude_sums
+        self.altitude_counts += other.altitude_counts
+
+    @property
+    def points(self):
+        return int(self.counts.sum()) + self.pending_points
+
+    def density_image(self, cmap='inferno'):
+        # Log scale, a handful of points on a road should still show next to a busy square
+        self.flush()
+        scaled = np.log1p(self.counts) / max(np.log1p(self.counts.max()), 1)
+        image = colormaps[cmap](scaled.reshape(self.height, self.width))
+        image[..., 3] = self.counts.reshape(self.height, self.width) > 0
+        return image
+
+    def altitude_image(self, cmap='viridis'):
+        # Mean altitude per cell, stretched between the 2nd and 98th percentile of the cells
+        self.flush()
+        has_altitude = self.altitude_counts > 0
+        means = np.divide(self.altitude_sums, self.altitude_counts, out=np.zeros(len(self.counts)), where=has_altitude)
+        low, high = np.percentile(means[has_altitude], [2, 98]) if has_altitude.any() else (0, 1)
+        scaled = np.clip((means - low) / max(high - low, 1e-9), 0, 1)
+        image = colormaps[cmap](scaled.reshape(self.height, self.width))
+        image[..., 3] = has_altitude.reshape(self.height, self.width)
+        return image
+
+
+def save_image(image, directory, name, tile_size=None):
+    # One PNG, or tile_size x tile_size tiles named <name>_<row>_<column>.png
+    os.makedirs(directory, exist_ok=True)
+    if not tile_size:
+        imsave(os.path.join(directory, f"{name}.png"), image)
+        return 1
+    tiles = 0
+    for row in range(0, image.shape[0], tile_size):
+        for column in range(0, image.shape[1], tile_size):
+            imsave(os.path.join(directory, f"{name}_{row // tile_size}_{column // tile_size}.png"),
+                   image[row:row + tile_size, column:column + tile_size])
+            tiles += 1
+    return tiles
+
+
+def iter_parser_points(data_directory, users=None, start=None, end=None, modes=None, simplifier=None):
+    """
+    Yields (latitudes, longitudes, altitudes) per .plt file, for the given users, trackpoints in
+    [start, end) and, with modes, only trackpoints covered by a label of one of those modes.
+    Files entirely outside the time range or of users without labels are not parsed. With a
+    simplifier, each track is simplified before it is filtered, like the simplified tier.
+    """
+    labels = {}
+    for user_id, plt_file_path, labels_file in iter_plt_files(data_directory):
+        if users is not None and user_id not in users:
+            continue
+        if modes:
+            if user_id not in labels:
+                labels[user_id] = parse_labels(labels_file) if os.path.exists(labels_file) else LabelIndex()
+            if not len(labels[user_id]):
+                continue
+        if start or end:
+            bounds = time_bounds(plt_file_path)
+            if bounds is None or (start and bounds[1] < start) or (end and bounds[0] >= end):
+                continue
+
+        track = read_plt(plt_file_path)
+        if simplifier:
+            track = simplifier.simplify(track)[0]
+        keep = np.ones(track.size, dtype=bool)
+        if start:
+            keep &= track.date_time >= np.datetime64(start, 's')
+        if end:
+            keep &= track.date_time < np.datetime64(end, 's')
+        if modes:
+            in_mode = np.zeros(track.size, dtype=bool)
+            for mode, first, stop in labels[user_id].segments(track.date_time):
+                if mode in modes:
+                    in_mode[first:stop] = True
+            keep &= in_mode
+        yield track.latitude[keep], track.longitude[keep], track.altitude[keep]
+
+
+def iter_db_points(users=None, start=None, end=None, modes=None, tier='raw', chunk_size=500000, **db_config):
+    # Same filters as iter_parser_points, on the loaded tables; rows are streamed in chunks
+    from DbConnector import DbConnector
+    from streaming import stream_arrays
+
+    conditions, params = ["TRUE"], []
+    if users:
+        conditions.append(f"A.user_id IN ({', '.join(['%s'] * len(users))})")
+        params += users
+    if start:
+        conditions.append("T.date_time >= %s")
+        params.append(start)
+    if end:
+        conditions.append("T.date_time < %s")
+        params.append(end)
+    if modes:
+        conditions.append(f"A.transportation_mode IN ({', '.join(['%s'] * len(modes))})")
+        params += modes
+    query = f"""
+    SELECT T.latitude, T.longitude, T.altitude
+    FROM {TRACKPOINT_TABLES[tier]} T
+    JOIN Activity A ON T.activity_id = A.id
+    WHERE {' AND '.join(conditions)}
+    """
+    connector = DbConnector(VERBOSE=False, **db_config)
+    try:
+        yield from stream_arrays(connector.db_connection, query, tuple(params), (float, float, float), chunk_size)
+    finally:
+        connector.close_connection()
+
+
+def _render_users(job):
+    # Runs in a worker process: renders a share of the users into a Heatmap of its own
+    data_directory, users, start, end, modes, bounds, width, height, simplifier = job
+    heatmap = Heatmap(bounds, width, height)
+    for latitudes, longitudes, altitudes in iter_parser_points(data_directory, users, start, end, modes, simplifier):
+        heatmap.add(latitudes, longitudes, altitudes)
+    heatmap.flush()
+    return heatmap
+
+
+def render_heatmap(source='parser', data_directory="dataset/Data", users=None, start=None, end=None, modes=None,
+                   bounds=BEIJING_BOUNDS, width=1024, height=1024, workers=1, tier='raw', tolerance=10.0):
+    heatmap = Heatmap(bounds, width, height)
+    if source == 'db':
+        # The simplified tier was simplified at ingest, with the tolerance given to GeoLifeTask.py
+        for latitudes, longitudes, altitudes in iter_db_points(users, start, end, modes, tier):
+            heatmap.add(latitudes, longitudes, altitudes)
+        return heatmap
+
+    simplifier = TrackSimplifier(tolerance) if tier == 'simplified' else None
+    if workers <= 1:
+        for latitudes, longitudes, altitudes in iter_parser_points(data_directory, users, start, end, modes, simplifier):
+            heatmap.add(latitudes, longitudes, altitudes)
+        return heatmap
+    # Users are dealt out round-robin, each worker returns one partial grid
+    all_users = users or sorted(entry.name for entry in os.scandir(data_directory) if entry.is_dir())
+    jobs = [(data_directory, all_users[i::workers], start, end, modes, bounds, width, height, simplifier)
+            for i in range(min(workers, len(all_users)))]
+    with Pool(processes=workers) as pool:
+        for partial in pool.imap_unordered(_render_users, jobs):
+            heatmap.merge(partial)
+    return heatmap
+
+
+def scatter(args):
+    import matplotlib.pyplot as plt
+
+    # Load the data for the specified users
+    simplifier = TrackSimplifier(args.tolerance) if args.tier == 'simplified' else None
+    df = pd.concat([load_plt_data(os.path.join(args.data_directory, user_id, 'Trajectory'), simplifier)
+                    for user_id in args.users or ['128']])
+
+    plt.figure(figsize=(10, 8))
+    points = plt.scatter(df['lon'], df['lat'], c=df['alt'], cmap='viridis', s=1)
+    plt.colorbar(points, label='Altitude (feet)')
+    plt.xlabel('Longitude')
+    plt.ylabel('Latitude')
+    plt.title(f"Geolife Dataset: Latitude vs. Longitude Colored by Altitude ({len(df)} {args.tier} points)")
+    plt.show()
+
+
+def heatmap(args):
+    started = time.perf_counter()
+    result = render_heatmap(args.source, args.data_directory, args.users, args.start, args.end, args.modes,
+                            tuple(args.bounds), args.width, args.height, args.workers, args.tier, args.tolerance)
+    tiles = save_image(result.density_image(), args.output, 'density', args.tile_size)
+    tiles += save_image(result.altitude_image(), args.output, 'altitude', args.tile_size)
+    print(f"Rendered {result.points} points into {tiles} PNG files in {args.output} "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Plot Geolife trackpoints")
+    parser.add_argument('mode', nargs='?', choices=['scatter', 'heatmap'], default='scatter')
+    parser.add_argument('--users', nargs='+', help="user ids, default 128 for scatter and everyone for heatmap")
+    parser.add_argument('--data-directory', default="dataset/Data")
+    parser.add_argument('--tier', choices=['raw', 'simplified'], default='raw',
+                        help="simplified plots the Douglas-Peucker simplified tracks, far fewer points")
+    parser.add_argument('--tolerance', type=float, default=10.0, help="simplification tolerance in meters, for the .plt files")
+    parser.add_argument('--source', choices=['parser', 'db'], default='parser',
+                        help="heatmap from the .plt files or from the loaded tables")
+    parser.add_argument('--start', type=datetime.fromisoformat, help="first time to include, e.g. 2008-01-01")
+    parser.add_argument('--end', type=datetime.fromisoformat, help="time to stop before")
+    parser.add_argument('--modes', nargs='+', help="only trackpoints labeled with these transportation modes")
+    parser.add_argument('--bounds', type=float, nargs=4, default=list(BEIJING_BOUNDS),
+                        metavar=('MIN_LAT', 'MIN_LON', 'MAX_LAT', 'MAX_LON'))
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--height', type=int, default=1024)
+    parser.add_argument('--tile-size', type=int, help="split the images into tiles of this many pixels")
+    parser.add_argument('--workers', type=int, default=1, help="parser processes for heatmap")
+    parser.add_argument('--output', default="heatmaps")
+    args = parser.parse_args()
+
+    if args.mode == 'heatmap':
+        heatmap(args)
+    else:
+        scatter(args)
+
+
+if __name__ == '__main__':
+    main()